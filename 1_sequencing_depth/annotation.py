@@ -0,0 +1 @@
+../2_sequencing_tech/bin/annotation.py
\ No newline at end of file
@@ -0,0 +1 @@
+../2_sequencing_tech/bin/array_cache.py
\ No newline at end of file
@@ -18,6 +18,7 @@ BASE="$1"		      # basename of the dataset
 SIZE=${SLURM_ARRAY_TASK_ID})  # size of subset in gigabases 
 THREADS=${SLURM_JOB_CPUS_PER_NODE}
 REFDIR="$(pwd)/REF"
+BINDIR="$(pwd)"
 
 # create new output directories for the assembly
 NUM_GB=$(printf %02dGB ${NUM})
@@ -26,7 +27,7 @@ cd       "${BASE}-assembly/${BASE}-${NUM_GB}"
 
 
 # randomly select a $NUM gigabases of the mapped sequence reads
-../../subset.py $((SIZE*1000000000)) "${BASE}-${NUM_GB}" \
+"${BINDIR}/subset.py" $((SIZE*1000000000)) "${BASE}-${NUM_GB}" \
     ../../${BASE}-parts/${BASE}-read-stats \
     ../../${BASE}-parts/${BASE}-???/${BASE}-???-mapped-1.fq
 
@@ -68,10 +69,8 @@ blat "${REFDIR}/${REFNAME}.fa" "${BASE}-${NUM_GB}.GapCloser.fa" \
     -ooc="${REFDIR}/${REFNAME}-11.ooc" -fine "${PSL}-fine.psl"
 
 # filter the alignments - only high quality alignments - max 1 per scaffold
-# tail skips table header; sort by scaffold name, then by aligned bases
-# awk checks aligned bases against length & scaffold name against prior output 
-tail -n +6 "${PSL}-fine.psl" \
-   | sort -k 10.2,10.2r -k 10.10,10n -k 10.3,10n -k 1,1nr \
-   | awk '($1 >= 0.95 * $11 && $10 != PRIOR) {print; PRIOR = $10}' \
-   > "${PSL}-fine-filter.table"
+# keeps the alignment with most aligned bases for each scaffold if they
+# cover at least 95% of its length
+"${BINDIR}/best_hits.py" --score matches --min-coverage 0.95 \
+   "${PSL}-fine.psl" > "${PSL}-fine-filter.table"
 
@@ -0,0 +1 @@
+../2_sequencing_tech/bin/best_hits.py
\ No newline at end of file
@@ -0,0 +1 @@
+../2_sequencing_tech/bin/exon_coverage.py
\ No newline at end of file
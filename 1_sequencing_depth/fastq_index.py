@@ -0,0 +1 @@
+../2_sequencing_tech/bin/fastq_index.py
\ No newline at end of file
@@ -0,0 +1 @@
+../2_sequencing_tech/bin/index_fastq.py
\ No newline at end of file
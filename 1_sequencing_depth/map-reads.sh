@@ -20,6 +20,7 @@ BASE="$(basename "$1" .sra)"
 PART_NUM=$SLURM_ARRAY_TASK_ID
 THREADS=$SLURM_JOB_CPUS_PER_NODE
 REFDIR="$(pwd)/REF"
+BINDIR="$(pwd)"
 
 
 # create subdirectories for this output
@@ -94,11 +95,11 @@ samtools view "${CASE}-tophat2/accepted_hits.bam" \
    | gawk '(and($2 + 16, 1005) == 161) {print "@" $1 "/2\t" $10 "\t+\t" $11}' \
    | sort --buffer-size=1G -k 1,1 | tr '\011' '\012' > "${CASE}-mapped-2.fq"
 
-# count reads and bases in each of the outputs and record in read-stats file
+# index each of the outputs, which counts its reads and bases, and record
+# the counts in the read-stats file
 for FILE in "${CASE}-mapped-1.fq" "${CASE}-mapped-2.fq"; do
    F=$(basename "${FILE}" .fq); F=${F/-mapped-/ }; F=${F/-/ };
-   cat "$FILE" | paste - - - - \
-       | awk "{B+=length(\$2)}; END {print \"$F\", NR, B}"
+   echo "$F $("${BINDIR}/index_fastq.py" --totals "$FILE")" \
         >> ../${BASE}-read-stats
 done
 
@@ -0,0 +1 @@
+../2_sequencing_tech/bin/read_selection.py
\ No newline at end of file
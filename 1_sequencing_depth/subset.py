@@ -1,74 +1,89 @@
 #!/usr/bin/python3
 
-import sys
 import random
-import os.path
-
-random.seed(0)
-
-# Usage: ./subset.py <subset-size> output-basename statistics-file fastq-files-1.fq 
+import argparse
+# the FastQ reader and hash-based read selection are shared with the
+# sequencing technology analysis (see README)
+import fastq
+import read_selection
+import subset_output
+
+# Usage: ./subset.py <subset-size> output-basename statistics-file fastq-files-1.fq
 # ./subset.py 100000 tests/subset tests/171p5-00?/171p5-00?-1.fq
 # This routine is generally within 1 read-pair of the desired size.
 # A better system could half this to a max difference of +/- 0.5 read-pair.
+#
+# With --hash, read-pairs are chosen by a seeded hash of their names instead
+# of a sequential random walk, so the part files are subset concurrently in
+# --processes worker processes and the result does not depend on how the
+# reads are split into parts.  The statistics file must still be given, but
+# is not read then.
+
+# The FastQ reader assumes each entry is four lines and both files have the
+# same read orders, and stops with an error if the names of two mates differ.
+
+
+def main():
+   ap = argparse.ArgumentParser()
+   ap.add_argument('size', type=int)
+   ap.add_argument('output_basename')
+   ap.add_argument('statistics_file')
+   ap.add_argument('fastq', nargs='+')
+   ap.add_argument('--hash', action='store_true', help='Choose read-pairs by a hash of their names')
+   ap.add_argument('--seed', type=int, default=0)
+   ap.add_argument('-p', '--processes', type=int, default=1)
+   args = ap.parse_args()
 
+   # generate the second FastQ filename from the first
+   fastq_pairs = [(file1name, file1name.replace('-1.fq', '-2.fq'))
+                  for file1name in args.fastq]
+   output1name = '{}-1.fq'.format(args.output_basename)
+   output2name = '{}-2.fq'.format(args.output_basename)
 
+   if args.hash:
+      subset_bases = read_selection.hash_subsets(fastq_pairs, [args.size],
+         [subset_output.SubsetOutput(output1name, output2name)], args.seed, args.processes)
+      print('Final output size:', subset_bases[0])
+      return
 
-# Iterator to fetch pair of sequences, one from each of two FastQ files.
-# assumes each entry is four lines and both files have the same read orders
-# WARNING: This routine ASSUMES the read names are the same. It does not check.
-# It will produce garbage if this constraint on the input is violated.
-class readFastQ():
-   def __init__(self, filename1, filename2):
-      self.file1 = open(filename1, 'r') 
-      self.file2 = open(filename2, 'r') 
-   def __iter__(self):
-      return self
-   def __next__(self):
-      # read next four lines from both files
-      lines1 = [self.file1.__next__().rstrip() for x in range(4)]
-      lines2 = [self.file2.__next__().rstrip() for x in range(4)]
-      name = lines1[0][1:].rsplit('/', 1)[0]
-      name = name.rsplit(' ', 1)[0]
-      return (name, lines1[1], lines1[3], lines2[1], lines2[3])
+   random.seed(args.seed)
 
+   # sum the base counts listed in the read statistics file
+   base_total = 0
+   for line in open(args.statistics_file):
+      base_total += int(line.split()[4])
+   print("Total Bases:", base_total)
 
-# sum the base counts listed in the read statistics file
-base_total = 0
-for line in open(sys.argv[3]):
-   base_total += int(line.split()[4])
-print("Total Bases:", base_total)
 
+   # now read the FastQ files -- choosing read-pairs for output
 
-# now read the FastQ files -- choosing read-pairs for output
+   # open the output files
+   output1 = fastq.open_output(output1name)
+   output2 = fastq.open_output(output2name)
 
-# open the output files
-output1 = open('{}-1.fq'.format(sys.argv[2]), 'w')
-output2 = open('{}-2.fq'.format(sys.argv[2]), 'w')
+   # target are the number of bases still to be output
+   # remaining are the number of bases yet to be considered
+   target = args.size
+   remaining = base_total
 
-# target are the number of bases still to be output
-# remaining are the number of bases yet to be considered
-target = int(sys.argv[1])
-remaining = base_total
+   # now read the FastQ files -- choosing read-pairs for output
+   for file1name, file2name in fastq_pairs:
+      print('Now reading:', file1name, file2name)
 
-# now read the FastQ files -- choosing read-pairs for output
-for file1name in sys.argv[4:]:
-   # generate the second FastQ filename from the first
-   file2name = file1name.replace('-1.fq', '-2.fq')
-   print('Now reading:', file1name, file2name)
-
-   for cluster in readFastQ(file1name, file2name):
-      bases = len(cluster[1]) + len(cluster[3])
-
-      # want to output target bases of the remaining bases
-      if random.random() < float(target) / remaining:
-         output1.write('@{}/1\n{}\n+\n{}\n'.format(cluster[0],
-                                       cluster[1], cluster[2]))
-         output2.write('@{}/2\n{}\n+\n{}\n'.format(cluster[0],
-                                       cluster[3], cluster[4]))
-         target -= bases
-      remaining -= bases
-output2.close()
-output1.close()
-
-# report how close to the target size the output is
-print('Final output size:', int(sys.argv[1]) - target)
+      for cluster in fastq.read_pairs(file1name, file2name):
+         bases = fastq.pair_bases(cluster)
+
+         # want to output target bases of the remaining bases
+         if random.random() < float(target) / remaining:
+            fastq.write_pair(output1, output2, cluster)
+            target -= bases
+         remaining -= bases
+   output2.close()
+   output1.close()
+
+   # report how close to the target size the output is
+   print('Final output size:', args.size - target)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1 @@
+../2_sequencing_tech/bin/subset_output.py
\ No newline at end of file
@@ -0,0 +1,163 @@
+import attr
+import os
+import re
+import numpy
+import array_cache
+from collections import OrderedDict
+
+ANNOTATION_STORE_VERSION = 1
+ANNOTATION_STORE_ARRAYS = ['chromosome_lengths', 'transcript_chromosome', 'transcript_strand', 'exon_offsets', 'exon_chromosome', 'exon_starts', 'exon_ends']
+
+GTF_TRANSCRIPT_ID = re.compile(r'(?:^|;)\s*transcript_id "([^"]*)"')
+GFF3_PARENT = re.compile(r'(?:^|;)Parent=([^;,]*)')
+
+
+# Exons are grouped by the transcript_id of GTF files or the Parent of GFF3
+# files
+def exon_transcript_id(attributes):
+    match = GTF_TRANSCRIPT_ID.search(attributes)
+    if match is None:
+        match = GFF3_PARENT.search(attributes)
+    return match.group(1) if match is not None else ''
+
+
+# A compiled annotation holds the exons of every transcript in flat arrays.
+# Transcripts are numbered in order of first appearance, and each takes the
+# chromosome (an index into chromosomes) and strand of its first exon.  The
+# exons of transcript i are the slice exon_offsets[i]:exon_offsets[i + 1] of
+# exon_chromosome/exon_starts/exon_ends, as zero-based half-open intervals
+# ordered 5' to 3'.  Chromosome lengths come from ##sequence-region headers,
+# with -1 where there is none.
+@attr.s
+class Annotation(object):
+    chromosomes = attr.ib()
+    transcripts = attr.ib()
+    chromosome_lengths = attr.ib()
+    transcript_chromosome = attr.ib()
+    transcript_strand = attr.ib()
+    exon_offsets = attr.ib()
+    exon_chromosome = attr.ib()
+    exon_starts = attr.ib()
+    exon_ends = attr.ib()
+
+    def transcript_exons(self, i):
+        start = self.exon_offsets[i]
+        end = self.exon_offsets[i + 1]
+        return self.exon_starts[start:end], self.exon_ends[start:end]
+
+    def strand(self, i):
+        return chr(self.transcript_strand[i])
+
+    # The union of the exons on each chromosome as sorted, non-overlapping
+    # intervals, with touching exons joined.  Yields every chromosome in name
+    # order, including those without exons.
+    def merged_exons(self):
+        exon_chromosome = numpy.asarray(self.exon_chromosome)
+        starts = numpy.asarray(self.exon_starts)
+        ends = numpy.asarray(self.exon_ends)
+        nonempty = ends > starts
+        order = numpy.lexsort((starts, exon_chromosome))
+        order = order[nonempty[order]]
+        chromosome_bounds = numpy.searchsorted(exon_chromosome[order], numpy.arange(len(self.chromosomes) + 1))
+        for chromosome_id in sorted(range(len(self.chromosomes)), key=self.chromosomes.__getitem__):
+            rows = order[chromosome_bounds[chromosome_id]:chromosome_bounds[chromosome_id + 1]]
+            if len(rows) == 0:
+                yield(self.chromosomes[chromosome_id], starts[rows], ends[rows])
+                continue
+            chromosome_starts = starts[rows]
+            reach = numpy.maximum.accumulate(ends[rows])
+            run_starts = numpy.flatnonzero(numpy.concatenate(([True], chromosome_starts[1:] > reach[:-1])))
+            run_ends = numpy.concatenate((run_starts[1:], [len(rows)])) - 1
+            yield(self.chromosomes[chromosome_id], chromosome_starts[run_starts], reach[run_ends])
+
+
+def compile_annotation(fn):
+    chromosome_ids = OrderedDict()
+    chromosome_lengths = {}
+    transcript_ids = OrderedDict()
+    transcript_chromosome = []
+    transcript_strand = []
+    exon_transcript = []
+    exon_chromosome = []
+    exon_starts = []
+    exon_ends = []
+    with open(fn) as gff_h:
+        for line in gff_h:
+            if line[0] != '#':
+                sp_line = line.rstrip(os.linesep).split('\t')
+                if sp_line[2] != 'exon':
+                    continue
+                chromosome = sp_line[0]
+                if chromosome not in chromosome_ids:
+                    chromosome_ids[chromosome] = len(chromosome_ids)
+                transcript = exon_transcript_id(sp_line[8])
+                if transcript not in transcript_ids:
+                    transcript_ids[transcript] = len(transcript_ids)
+                    transcript_chromosome.append(chromosome_ids[chromosome])
+                    transcript_strand.append(ord(sp_line[6]))
+                exon_transcript.append(transcript_ids[transcript])
+                exon_chromosome.append(chromosome_ids[chromosome])
+                # GFF uses 1-based inclusive numbering.  We switch to 0-based
+                # half-open.
+                exon_starts.append(int(sp_line[3]) - 1)
+                exon_ends.append(int(sp_line[4]))
+            elif line[:18] == '##sequence-region ':
+                sp_line = line.rstrip().split(' ')
+                if sp_line[1] not in chromosome_ids:
+                    chromosome_ids[sp_line[1]] = len(chromosome_ids)
+                chromosome_lengths[sp_line[1]] = max(chromosome_lengths.get(sp_line[1], -1), int(sp_line[3]))
+
+    exon_transcript = numpy.array(exon_transcript, dtype=numpy.int64)
+    exon_starts = numpy.array(exon_starts, dtype=numpy.int64)
+    exon_ends = numpy.array(exon_ends, dtype=numpy.int64)
+    transcript_strand = numpy.array(transcript_strand, dtype=numpy.uint8)
+
+    # Order exons by transcript, then 5' to 3'
+    minus = transcript_strand[exon_transcript] == ord('-')
+    order = numpy.lexsort((numpy.where(minus, -exon_starts, exon_starts), exon_transcript))
+    exon_offsets = numpy.searchsorted(exon_transcript[order], numpy.arange(len(transcript_ids) + 1))
+
+    return Annotation(list(chromosome_ids),
+                      list(transcript_ids),
+                      numpy.array([chromosome_lengths.get(chromosome, -1) for chromosome in chromosome_ids], dtype=numpy.int64),
+                      numpy.array(transcript_chromosome, dtype=numpy.int32),
+                      transcript_strand,
+                      exon_offsets.astype(numpy.int64),
+                      numpy.array(exon_chromosome, dtype=numpy.int32)[order],
+                      exon_starts[order],
+                      exon_ends[order])
+
+
+# A compiled annotation is stored as an array cache next to the GTF/GFF file
+# (<annotation>.store, see array_cache.py).
+def annotation_store_path(fn):
+    return '{}.store'.format(fn)
+
+
+def build_annotation_store(fn):
+    key = array_cache.source_key(fn, ANNOTATION_STORE_VERSION)
+    annotation = compile_annotation(fn)
+    array_cache.write_array_cache(annotation_store_path(fn), key, {name: getattr(annotation, name) for name in ANNOTATION_STORE_ARRAYS}, {name: getattr(annotation, name) for name in ['chromosomes', 'transcripts']})
+    return load_annotation_store(fn)
+
+
+def load_annotation_store(fn):
+    cache = array_cache.load_array_cache(annotation_store_path(fn), array_cache.source_key(fn, ANNOTATION_STORE_VERSION), ANNOTATION_STORE_ARRAYS, ['chromosomes', 'transcripts'])
+    if cache is None:
+        return None
+    arrays, name_lists = cache
+    return Annotation(name_lists['chromosomes'], name_lists['transcripts'], **arrays)
+
+
+# Use a fresh compiled store when there is one, otherwise read the annotation
+def annotation_for(fn):
+    annotation = load_annotation_store(fn)
+    if annotation is None:
+        annotation = compile_annotation(fn)
+    return annotation
+
+
+def write_exon_bed(annotation, f):
+    for chromosome, starts, ends in annotation.merged_exons():
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            f.write('{}\t{}\t{}\n'.format(chromosome, start, end))
@@ -0,0 +1,51 @@
+import os
+import shutil
+import numpy
+
+# Caches of a parsed file kept as a directory next to it: NumPy arrays as
+# <name>.npy, lists of names as <name>.txt with one per line, and source.txt
+# holding the key of the file they were built from.  The key is a format
+# version with the size and mtime of the file, so a cache is ignored once
+# the file or the format changes.  Arrays are memory-mapped when loaded, so
+# forked workers share their pages read-only.
+
+
+def source_key(fn, version):
+    stat = os.stat(fn)
+    return '{}\t{}\t{}'.format(version, stat.st_size, stat.st_mtime_ns)
+
+
+# The key is taken before the file is parsed, so a file changed while its
+# cache was built leaves the cache stale
+def write_array_cache(path, key, arrays, name_lists):
+    # Write to a temporary directory and rename it into place, so concurrent
+    # readers only ever see a complete cache
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        numpy.save(os.path.join(tmp_path, '{}.npy'.format(name)), array)
+    for name, names in name_lists.items():
+        with open(os.path.join(tmp_path, '{}.txt'.format(name)), 'w') as names_h:
+            names_h.write(''.join('{}\n'.format(entry) for entry in names))
+    with open(os.path.join(tmp_path, 'source.txt'), 'w') as source_h:
+        source_h.write('{}\n'.format(key))
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+# The arrays and name lists of a cache as two dictionaries, or None if it is
+# missing, incomplete or has a different key
+def load_array_cache(path, key, array_names, name_list_names):
+    try:
+        with open(os.path.join(path, 'source.txt')) as source_h:
+            if source_h.read().rstrip(os.linesep) != key:
+                return None
+        name_lists = {}
+        for name in name_list_names:
+            with open(os.path.join(path, '{}.txt'.format(name))) as names_h:
+                name_lists[name] = names_h.read().split('\n')[:-1]
+        arrays = {name: numpy.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode='r') for name in array_names}
+    except (OSError, ValueError):
+        return None
+    return arrays, name_lists
@@ -27,11 +27,12 @@ def get_gap_ranges(depths):
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument('-a', '--alignment', required=True)
+    ap.add_argument('-p', '--processes', type=int, default=1)
     ap.add_argument('-o', '--output', required=True)
     ap.add_argument('-c', '--complete-transcripts', required=True)
     args = ap.parse_args()
 
-    covered_transcript_alignments, complete_transcript_alignments, transcript_coverage, query_counts = last.analyse_transcript_alignment(args.alignment, complete_scaffold_threshold=0.0)
+    covered_transcript_alignments, complete_transcript_alignments, transcript_coverage, query_counts = last.analyse_transcript_alignment(args.alignment, complete_scaffold_threshold=0.0, compact=True, processes=args.processes)
 
     full_transcript_count = len(complete_transcript_alignments.keys())
     unambiguous_transcript_alignments = defaultdict(list)
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
-import os
 import argparse
+import numpy
+import depth_matrix
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
@@ -16,12 +17,11 @@ if __name__ == '__main__':
         with open(args.transcript_names_file) as transcript_names_h:
             transcript_names.update((line.strip() for line in transcript_names_h))
 
-    with open(args.coverage_file) as coverage_h, \
-            open(args.output_file, 'w') as output_h:
-        for line in coverage_h:
-            sp_line = line.rstrip(os.linesep).split('\t')
-            transcript = sp_line[0]
-            base_coverage = [int(entry) for entry in sp_line[1:]]
-            average_depth = sum(base_coverage) / len(base_coverage)
+    coverage = depth_matrix.depth_matrix_for(args.coverage_file, transcript_names)
+    with open(args.output_file, 'w') as output_h:
+        offsets = numpy.asarray(coverage.offsets).tolist()
+        for transcript, start, end in zip(coverage.names, offsets[:-1], offsets[1:]):
             if transcript_names is None or transcript in transcript_names:
+                base_coverage = coverage.depths[start:end]
+                average_depth = int(numpy.sum(base_coverage, dtype=numpy.uint64)) / len(base_coverage)
                 output_h.write(f'{transcript}\t{average_depth}\n')
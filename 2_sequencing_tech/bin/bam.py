@@ -0,0 +1,501 @@
+import os
+import struct
+import zlib
+import numpy
+
+# Reading and writing of BGZF-compressed BAM files and their BAI indexes,
+# enough to stream the aligned reference segments of coordinate-sorted reads
+# over a region.  Records are decoded in batches: only the walk along the
+# block_size fields is a Python loop, and the fixed fields and CIGARs of a
+# batch are gathered with NumPy.
+
+BGZF_MAX_BLOCK_DATA = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+BGZF_HEADER = struct.Struct('<4BIBBH')
+BAM_BATCH_SIZE = 16 * 1024 * 1024
+
+# Reads samtools depth skips by default: unmapped, secondary, QC fail and
+# duplicate
+DEFAULT_FLAG_FILTER = 0x4 | 0x100 | 0x200 | 0x400
+
+CIGAR_OPS = 'MIDNSHP=X'
+CIGAR_CONSUMES_REFERENCE = numpy.array([True, False, True, True, False, False, False, True, True, False, False, False, False, False, False, False])
+CIGAR_ALIGNS = numpy.array([True, False, False, False, False, False, False, True, True, False, False, False, False, False, False, False])
+SEQ_CODES = {base: code for code, base in enumerate('=ACMGRSVTWYHKDBN')}
+
+BAI_LINEAR_SHIFT = 14
+BLOCK_SIZE = struct.Struct('<i')
+
+
+# Yields the file offset and uncompressed data of each BGZF block from
+# coffset on
+def bgzf_blocks(f, coffset=0):
+    f.seek(coffset)
+    while True:
+        header = f.read(BGZF_HEADER.size)
+        if len(header) < BGZF_HEADER.size:
+            return
+        id1, id2, cm, flg, mtime, xfl, os_id, xlen = BGZF_HEADER.unpack(header)
+        if id1 != 31 or id2 != 139 or cm != 8 or not flg & 4:
+            raise ValueError('Not a BGZF block at offset {}'.format(coffset))
+        extra = f.read(xlen)
+        block_size = None
+        offset = 0
+        while offset + 4 <= xlen:
+            slen = struct.unpack_from('<H', extra, offset + 2)[0]
+            if extra[offset:offset + 2] == b'BC' and slen == 2:
+                block_size = struct.unpack_from('<H', extra, offset + 4)[0] + 1
+            offset += 4 + slen
+        if block_size is None:
+            raise ValueError('BGZF block at offset {} has no size'.format(coffset))
+        rest = f.read(block_size - BGZF_HEADER.size - xlen)
+        data = zlib.decompress(rest[:-8], -15)
+        if len(data) != struct.unpack_from('<I', rest, len(rest) - 4)[0]:
+            raise ValueError('BGZF block at offset {} is truncated'.format(coffset))
+        yield(coffset, data)
+        coffset += block_size
+
+
+# Unaligned little-endian integers of the given byte width at each offset
+def le_integers(u8, offsets, width, dtype):
+    values = numpy.zeros(len(offsets), dtype=numpy.uint64)
+    for byte in range(width):
+        values |= u8[offsets + byte].astype(numpy.uint64) << numpy.uint64(8 * byte)
+    return values.astype('<u{}'.format(width)).view('<i{}'.format(width)).astype(dtype) if numpy.dtype(dtype).kind == 'i' else values.astype(dtype)
+
+
+# Parses the header at the start of data, returning the text, the
+# references as (name, length) pairs and the header size, or None while the
+# header is incomplete
+def parse_bam_header(data):
+    if len(data) < 8:
+        return None
+    if data[:4] != b'BAM\1':
+        raise ValueError('Not a BAM file')
+    offset = 8 + struct.unpack_from('<i', data, 4)[0]
+    if offset + 4 > len(data):
+        return None
+    text = data[8:offset].rstrip(b'\0').decode()
+    n_ref = struct.unpack_from('<i', data, offset)[0]
+    offset += 4
+    references = []
+    for _ in range(n_ref):
+        if offset + 4 > len(data):
+            return None
+        l_name = struct.unpack_from('<i', data, offset)[0]
+        if offset + 8 + l_name > len(data):
+            return None
+        name = data[offset + 4:offset + 4 + l_name].rstrip(b'\0').decode()
+        references.append((name, struct.unpack_from('<i', data, offset + 4 + l_name)[0]))
+        offset += 8 + l_name
+    return text, references, offset
+
+
+# The header text, the references and the virtual offset of the first record
+def read_bam_header(f):
+    data = b''
+    block_starts = []
+    block_coffsets = []
+    for coffset, block_data in bgzf_blocks(f):
+        block_starts.append(len(data))
+        block_coffsets.append(coffset)
+        data += block_data
+        header = parse_bam_header(data)
+        if header is not None:
+            text, references, size = header
+            block = int(numpy.searchsorted(block_starts, size, side='right')) - 1
+            return text, references, (block_coffsets[block] << 16) | (size - block_starts[block])
+    raise ValueError('Truncated BAM header')
+
+
+# Batches of BAM records from start_voffset up to, but not including,
+# records starting at end_voffset.  Yields the batch data as a uint8 array,
+# the offset of each record's block_size field in it, and the virtual offset
+# of each record followed by that of the end of the last.
+def record_batches(f, start_voffset, end_voffset=None, batch_size=BAM_BATCH_SIZE):
+    blocks = bgzf_blocks(f, start_voffset >> 16)
+    data = b''
+    block_starts = []
+    block_coffsets = []
+    skip = start_voffset & 0xffff
+    exhausted = False
+    # Bytes to read before parsing: a batch, or more to complete a record
+    # larger than a batch
+    wanted = batch_size
+    while True:
+        pieces = [data]
+        size = len(data)
+        while size < wanted and not exhausted:
+            block = next(blocks, None)
+            if block is None:
+                exhausted = True
+                break
+            coffset, block_data = block
+            if skip > 0:
+                block_data = block_data[skip:]
+                start = -skip
+                skip = 0
+            else:
+                start = 0
+            block_starts.append(size + start)
+            block_coffsets.append(coffset)
+            pieces.append(block_data)
+            size += len(block_data)
+            if end_voffset is not None and coffset > end_voffset >> 16:
+                break
+        data = b''.join(pieces)
+
+        offsets = []
+        position = 0
+        partial_size = 4
+        while position + 4 <= len(data):
+            record_size = BLOCK_SIZE.unpack_from(data, position)[0]
+            if position + 4 + record_size > len(data):
+                partial_size = 4 + record_size
+                break
+            offsets.append(position)
+            position += 4 + record_size
+        offsets = numpy.array(offsets, dtype=numpy.int64)
+
+        finished = exhausted and position == len(data)
+        if len(offsets) > 0:
+            bounds = numpy.append(offsets, position)
+            block_index = numpy.searchsorted(block_starts, bounds, side='right') - 1
+            voffsets = (numpy.array(block_coffsets, dtype=numpy.int64)[block_index] << 16) | (bounds - numpy.array(block_starts, dtype=numpy.int64)[block_index])
+            if end_voffset is not None:
+                before_end = int(numpy.count_nonzero(voffsets[:-1] < end_voffset))
+                if before_end < len(offsets):
+                    offsets = offsets[:before_end]
+                    voffsets = voffsets[:before_end + 1]
+                    finished = True
+        if len(offsets) > 0:
+            yield(numpy.frombuffer(data, dtype=numpy.uint8), offsets, voffsets)
+        if finished or (exhausted and len(offsets) == 0):
+            return
+
+        # Keep the partial record and the blocks it starts in
+        data = data[position:]
+        kept = max(int(numpy.searchsorted(block_starts, position, side='right')) - 1, 0)
+        block_starts = [start - position for start in block_starts[kept:]]
+        block_coffsets = block_coffsets[kept:]
+        wanted = max(batch_size, partial_size)
+
+
+# The fields of a batch of records that locate their aligned bases
+def record_fields(u8, offsets):
+    l_read_name = u8[offsets + 12].astype(numpy.int64)
+    return {
+        'ref_id': le_integers(u8, offsets + 4, 4, numpy.int64),
+        'pos': le_integers(u8, offsets + 8, 4, numpy.int64),
+        'mapq': u8[offsets + 13].astype(numpy.int64),
+        'bin': le_integers(u8, offsets + 14, 2, numpy.int64),
+        'n_cigar': le_integers(u8, offsets + 16, 2, numpy.int64),
+        'flag': le_integers(u8, offsets + 18, 2, numpy.int64),
+        'cigar_offsets': offsets + 36 + l_read_name,
+    }
+
+
+# Reference segments [starts, ends) aligned to read bases (CIGAR M, = and X)
+# of the selected records of a batch, and the record each comes from
+def aligned_segments(u8, fields, selected):
+    # Records without a CIGAR have no aligned bases
+    selected = selected & (fields['n_cigar'] > 0)
+    n_cigar = fields['n_cigar'][selected]
+    record_firsts = numpy.cumsum(n_cigar) - n_cigar
+    op_records = numpy.repeat(numpy.arange(len(n_cigar)), n_cigar)
+    op_offsets = fields['cigar_offsets'][selected][op_records] + 4 * (numpy.arange(len(op_records)) - record_firsts[op_records])
+    cigar = le_integers(u8, op_offsets, 4, numpy.int64)
+    ops = cigar & 0xf
+    lengths = cigar >> 4
+    advances = numpy.where(CIGAR_CONSUMES_REFERENCE[ops], lengths, 0)
+    advanced = numpy.cumsum(advances) - advances
+    starts = fields['pos'][selected][op_records] + advanced - advanced[record_firsts][op_records]
+    aligned = CIGAR_ALIGNS[ops] & (lengths > 0)
+    return starts[aligned], starts[aligned] + lengths[aligned], numpy.flatnonzero(selected)[op_records[aligned]]
+
+
+# The reference end of each record of a batch, one past its start when its
+# CIGAR covers no reference bases
+def reference_ends(u8, fields):
+    n_cigar = fields['n_cigar']
+    record_firsts = numpy.cumsum(n_cigar) - n_cigar
+    op_records = numpy.repeat(numpy.arange(len(n_cigar)), n_cigar)
+    op_offsets = fields['cigar_offsets'][op_records] + 4 * (numpy.arange(len(op_records)) - record_firsts[op_records])
+    cigar = le_integers(u8, op_offsets, 4, numpy.int64)
+    advances = numpy.where(CIGAR_CONSUMES_REFERENCE[cigar & 0xf], cigar >> 4, 0)
+    lengths = numpy.bincount(op_records, weights=advances, minlength=len(n_cigar)).astype(numpy.int64)
+    return fields['pos'] + numpy.maximum(lengths, 1)
+
+
+def bai_path(fn):
+    for path in ['{}.bai'.format(fn), '{}.bai'.format(os.path.splitext(fn)[0])]:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Writes a BAI index from the chunks of each bin, as [beg, end] virtual
+# offsets, and the first virtual offset of each 16 kb window of each
+# reference
+def write_bai(fn, bins, linear):
+    # Write to a temporary file and rename it into place, so concurrent
+    # readers only ever see a complete index
+    tmp_path = '{}.tmp{}'.format(fn, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(b'BAI\1' + struct.pack('<i', len(bins)))
+        for ref_bins, ref_linear in zip(bins, linear):
+            f.write(struct.pack('<i', len(ref_bins)))
+            for bin_id, chunks in sorted(ref_bins.items()):
+                f.write(struct.pack('<Ii', bin_id, len(chunks)))
+                for chunk_beg, chunk_end in chunks:
+                    f.write(struct.pack('<QQ', chunk_beg, chunk_end))
+            windows = max(ref_linear) + 1 if ref_linear else 0
+            offsets = []
+            for window in range(windows):
+                offsets.append(ref_linear.get(window, offsets[-1] if offsets else 0))
+            f.write(struct.pack('<i', windows))
+            f.write(struct.pack('<{}Q'.format(windows), *offsets))
+    os.rename(tmp_path, fn)
+
+
+# Indexes a coordinate-sorted BAM file in one pass over its records, as
+# samtools index does: consecutive records in one bin share a chunk, and
+# each window starts at the first record overlapping it
+def build_bai(fn):
+    with open(fn, 'rb') as f:
+        text, references, first_voffset = read_bam_header(f)
+        bins = [dict() for _ in references]
+        linear = [dict() for _ in references]
+        last_key = None
+        chunk_key = None
+        chunk = None
+        for u8, offsets, voffsets in record_batches(f, first_voffset):
+            fields = record_fields(u8, offsets)
+            placed = fields['ref_id'] >= 0
+            if not placed.any():
+                continue
+            ref_ids = fields['ref_id'][placed]
+            positions = fields['pos'][placed]
+            bin_ids = fields['bin'][placed]
+            begs = voffsets[:-1][placed]
+            ends = voffsets[1:][placed]
+            keys = (ref_ids << 32) | positions
+            if (keys[1:] < keys[:-1]).any() or (last_key is not None and keys[0] < last_key):
+                raise ValueError('BAM records must be sorted by coordinate')
+            last_key = int(keys[-1])
+
+            changes = numpy.flatnonzero((ref_ids[1:] != ref_ids[:-1]) | (bin_ids[1:] != bin_ids[:-1])) + 1
+            run_starts = numpy.concatenate(([0], changes)).tolist()
+            run_ends = numpy.append(changes, len(ref_ids)).tolist()
+            for run_start, run_end in zip(run_starts, run_ends):
+                key = (int(ref_ids[run_start]), int(bin_ids[run_start]))
+                if key == chunk_key:
+                    chunk[1] = int(ends[run_end - 1])
+                else:
+                    chunk_key = key
+                    chunk = [int(begs[run_start]), int(ends[run_end - 1])]
+                    bins[key[0]].setdefault(key[1], []).append(chunk)
+
+            # Every window each record overlaps, keeping the first record
+            # of each
+            first_windows = positions >> BAI_LINEAR_SHIFT
+            window_counts = ((reference_ends(u8, fields)[placed] - 1) >> BAI_LINEAR_SHIFT) - first_windows + 1
+            window_records = numpy.repeat(numpy.arange(len(ref_ids)), window_counts)
+            windows = first_windows[window_records] + numpy.arange(len(window_records)) - (numpy.cumsum(window_counts) - window_counts)[window_records]
+            _, firsts = numpy.unique((ref_ids[window_records] << 32) | windows, return_index=True)
+            for ref_id, window, voffset in zip(ref_ids[window_records[firsts]].tolist(), windows[firsts].tolist(), begs[window_records[firsts]].tolist()):
+                linear[ref_id].setdefault(window, voffset)
+    write_bai('{}.bai'.format(fn), bins, linear)
+
+
+# The BAI index of a BAM file, built next to it when there is none or it is
+# older than the BAM file
+def bai_for(fn):
+    path = bai_path(fn)
+    if path is None or os.stat(path).st_mtime_ns < os.stat(fn).st_mtime_ns:
+        build_bai(fn)
+        path = '{}.bai'.format(fn)
+    return read_bai(path)
+
+
+# BAI indexes hold, for each reference, the chunks of virtual offsets in each
+# bin and the smallest virtual offset of reads overlapping each 16 kb window
+def read_bai(fn):
+    with open(fn, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'BAI\1':
+        raise ValueError('Not a BAI index')
+    offset = 4
+    n_ref = struct.unpack_from('<i', data, offset)[0]
+    offset += 4
+    references = []
+    for _ in range(n_ref):
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            bins[bin_id] = numpy.frombuffer(data, dtype='<u8', count=2 * n_chunk, offset=offset).reshape(n_chunk, 2).astype(numpy.int64)
+            offset += 16 * n_chunk
+        n_intv = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        linear = numpy.frombuffer(data, dtype='<u8', count=n_intv, offset=offset).astype(numpy.int64)
+        offset += 8 * n_intv
+        references.append((bins, linear))
+    return references
+
+
+# Bins that may hold reads overlapping [beg, end), as in the SAM
+# specification
+def region_bins(beg, end):
+    end -= 1
+    bins = [0]
+    for first, shift in [(1, 26), (9, 23), (73, 20), (585, 17), (4681, 14)]:
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+    return bins
+
+
+def region_bin(beg, end):
+    end -= 1
+    for first, shift in [(4681, 14), (585, 17), (73, 20), (9, 23), (1, 26)]:
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+    return 0
+
+
+# Sorted, merged virtual offset chunks that hold every read of a reference
+# overlapping [beg, end)
+def region_chunks(bai, ref_id, beg, end):
+    if ref_id >= len(bai):
+        return []
+    bins, linear = bai[ref_id]
+    window = beg >> BAI_LINEAR_SHIFT
+    min_offset = int(linear[window]) if window < len(linear) else (int(linear[-1]) if len(linear) > 0 else 0)
+    chunks = [bins[bin_id] for bin_id in region_bins(beg, end) if bin_id in bins]
+    if len(chunks) == 0:
+        return []
+    chunks = numpy.concatenate(chunks)
+    chunks = chunks[chunks[:, 1] > min_offset]
+    chunks = chunks[numpy.argsort(chunks[:, 0], kind='mergesort')]
+    merged = []
+    for chunk_beg, chunk_end in chunks.tolist():
+        chunk_beg = max(chunk_beg, min_offset)
+        if len(merged) > 0 and chunk_beg <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], chunk_end)
+        else:
+            merged.append([chunk_beg, chunk_end])
+    return merged
+
+
+# Aligned reference segments of the reads of a reference overlapping
+# [beg, end), read through the index when there is one and otherwise by
+# scanning the file.  Yields batches of segment starts and ends.
+def region_aligned_segments(fn, ref_id, beg, end, flag_filter=DEFAULT_FLAG_FILTER, min_mapq=0, bai=None):
+    with open(fn, 'rb') as f:
+        if bai is not None:
+            chunks = region_chunks(bai, ref_id, beg, end)
+        else:
+            chunks = [[read_bam_header(f)[2], None]]
+        for chunk_beg, chunk_end in chunks:
+            for u8, offsets, _ in record_batches(f, chunk_beg, chunk_end):
+                fields = record_fields(u8, offsets)
+                selected = (fields['ref_id'] == ref_id) & (fields['flag'] & flag_filter == 0) & (fields['mapq'] >= min_mapq) & (fields['pos'] < end)
+                starts, ends, _ = aligned_segments(u8, fields, selected)
+                yield(starts, ends)
+                # Coordinate-sorted reads past the region end the search;
+                # unmapped reads (ref_id -1) come last
+                last_ref_id = fields['ref_id'][-1]
+                if last_ref_id < 0 or last_ref_id > ref_id or (last_ref_id == ref_id and fields['pos'][-1] >= end):
+                    return
+
+
+class BgzfWriter(object):
+    def __init__(self, f, level=6):
+        self.f = f
+        self.level = level
+        self.coffset = 0
+        self.buffer = bytearray()
+
+    # Virtual offset of the next byte written
+    def tell(self):
+        return (self.coffset << 16) | len(self.buffer)
+
+    def write(self, data):
+        data = memoryview(data)
+        while len(data) > 0:
+            taken = min(BGZF_MAX_BLOCK_DATA - len(self.buffer), len(data))
+            self.buffer += data[:taken]
+            data = data[taken:]
+            if len(self.buffer) == BGZF_MAX_BLOCK_DATA:
+                self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(bytes(self.buffer)) + compressor.flush()
+        block_size = BGZF_HEADER.size + 6 + len(cdata) + 8
+        self.f.write(BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6))
+        self.f.write(struct.pack('<2sHH', b'BC', 2, block_size - 1))
+        self.f.write(cdata)
+        self.f.write(struct.pack('<II', zlib.crc32(self.buffer) & 0xffffffff, len(self.buffer)))
+        self.coffset += block_size
+        self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.f.write(BGZF_EOF)
+
+
+def encode_record(name, flag, ref_id, pos, mapq, cigar, seq, qual=None, next_ref_id=-1, next_pos=-1, tlen=0):
+    cigar_values = [length << 4 | CIGAR_OPS.index(op) for op, length in cigar]
+    ref_length = sum(length for op, length in cigar if CIGAR_CONSUMES_REFERENCE[CIGAR_OPS.index(op)])
+    bin_id = region_bin(pos, pos + max(ref_length, 1)) if ref_id >= 0 else 4680
+    read_name = name.encode() + b'\0'
+    codes = [SEQ_CODES[base] for base in seq.upper()] + [0]
+    packed_seq = bytes(codes[i] << 4 | codes[i + 1] for i in range(0, len(seq), 2))
+    qual = bytes(qual) if qual is not None else b'\xff' * len(seq)
+    body = struct.pack('<iiBBHHHiiii', ref_id, pos, len(read_name), mapq, bin_id, len(cigar_values), flag, len(seq), next_ref_id, next_pos, tlen)
+    body += read_name + struct.pack('<{}I'.format(len(cigar_values)), *cigar_values) + packed_seq + qual
+    return struct.pack('<i', len(body)) + body, bin_id, pos + max(ref_length, 1)
+
+
+# Writes a coordinate-sorted BAM file, and its BAI index unless index is
+# False.  Records are (name, flag, ref_id, pos, mapq, cigar, seq) tuples with
+# CIGARs as lists of (op, length) pairs, optionally followed by qualities.
+def write_bam(fn, references, records, index=True, text=''):
+    bins = [dict() for _ in references]
+    linear = [dict() for _ in references]
+    with open(fn, 'wb') as f:
+        writer = BgzfWriter(f)
+        header = b'BAM\1' + struct.pack('<i', len(text)) + text.encode() + struct.pack('<i', len(references))
+        for name, length in references:
+            header += struct.pack('<i', len(name) + 1) + name.encode() + b'\0' + struct.pack('<i', length)
+        writer.write(header)
+        writer.flush()
+        last_key = None
+        chunk_key = None
+        chunk = None
+        for record in records:
+            data, bin_id, end = encode_record(*record)
+            ref_id, pos = record[2], record[3]
+            voffset = writer.tell()
+            writer.write(data)
+            if ref_id < 0:
+                continue
+            if last_key is not None and (ref_id, pos) < last_key:
+                raise ValueError('BAM records must be sorted by coordinate')
+            last_key = (ref_id, pos)
+            if chunk_key == (ref_id, bin_id):
+                chunk[1] = writer.tell()
+            else:
+                chunk_key = (ref_id, bin_id)
+                chunk = [voffset, writer.tell()]
+                bins[ref_id].setdefault(bin_id, []).append(chunk)
+            for window in range(pos >> BAI_LINEAR_SHIFT, ((end - 1) >> BAI_LINEAR_SHIFT) + 1):
+                linear[ref_id].setdefault(window, voffset)
+        writer.close()
+
+    if index:
+        write_bai('{}.bai'.format(fn), bins, linear)
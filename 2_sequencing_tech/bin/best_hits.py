@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import itertools
+import os
+import pickle
+import sys
+import tempfile
+from fractions import Fraction
+from operator import itemgetter
+
+# Best-hit selection for alignment tables (PSL, MAF).  Records for one query
+# must be adjacent, as written by blat and lastal; each query group is then
+# reduced in a single pass holding only its best records.  Inputs where a
+# query's records are scattered are first put in query order with an
+# external merge sort that spills sorted runs to disk.
+
+SPILL_CHUNK_SIZE = 1000000
+
+
+def best_in_group(group, score, rank=None, ties=True):
+    best_score = None
+    best = []
+    for record in group:
+        record_score = score(record)
+        if best_score is None or record_score > best_score:
+            best_score = record_score
+            best = [record]
+        elif ties and record_score == best_score:
+            best.append(record)
+    # Ties keep their input order unless ranked, and reverse sorting is stable
+    if rank is not None and len(best) > 1:
+        best.sort(key=rank, reverse=True)
+    return best
+
+
+def best_hits(records, query, score, rank=None, ties=True, coverage=None, min_score=None, min_coverage=None, presorted=True, chunk_size=SPILL_CHUNK_SIZE, spill_dir=None):
+    if not presorted:
+        records = spill_sorted(records, query, chunk_size=chunk_size, spill_dir=spill_dir)
+    for _, group in itertools.groupby(records, key=query):
+        for record in best_in_group(group, score, rank=rank, ties=ties):
+            if min_score is not None and score(record) < min_score:
+                continue
+            if min_coverage is not None and coverage(record) < min_coverage:
+                continue
+            yield(record)
+
+
+def read_spill_run(fn):
+    with open(fn, 'rb') as run_h:
+        while True:
+            try:
+                yield(pickle.load(run_h))
+            except EOFError:
+                return
+
+
+def spill_sorted(records, key, chunk_size=SPILL_CHUNK_SIZE, spill_dir=None):
+    records = iter(records)
+    chunk = list(itertools.islice(records, chunk_size))
+    chunk.sort(key=key)
+    next_chunk = list(itertools.islice(records, chunk_size))
+    if len(next_chunk) == 0:
+        yield from chunk
+        return
+
+    # Sorting is stable and heapq.merge prefers earlier runs on equal keys, so
+    # records of one query keep their input order
+    with tempfile.TemporaryDirectory(dir=spill_dir) as run_dir:
+        runs = []
+        while len(chunk) > 0:
+            run_fn = os.path.join(run_dir, 'run_{}'.format(len(runs)))
+            with open(run_fn, 'wb') as run_h:
+                for record in chunk:
+                    pickle.dump(record, run_h, pickle.HIGHEST_PROTOCOL)
+            runs.append(run_fn)
+            chunk = next_chunk
+            chunk.sort(key=key)
+            next_chunk = list(itertools.islice(records, chunk_size))
+        yield from heapq.merge(*(read_spill_run(run_fn) for run_fn in runs), key=key)
+
+
+# PSL records are the tab-separated fields of each alignment line, so joining
+# them with tabs gives back the line.  Header lines of psLayout tables are
+# skipped.
+def psl_records(f):
+    for line in f:
+        fields = line.rstrip('\r\n').split('\t')
+        if not fields[0].isdigit():
+            continue
+        yield(fields)
+
+
+def psl_matches(fields):
+    return int(fields[0])
+
+
+# Same as pslScore in the UCSC kent source for nucleotide alignments
+def psl_score(fields):
+    return int(fields[0]) + (int(fields[2]) >> 1) - int(fields[1]) - int(fields[4]) - int(fields[6])
+
+
+def psl_coverage(fields):
+    return Fraction(int(fields[0]), int(fields[10]))
+
+
+PSL_SCORES = {'matches': psl_matches, 'psl': psl_score}
+
+
+def best_psl_hits(f, score=psl_matches, ties=False, min_coverage=None, presorted=True, chunk_size=SPILL_CHUNK_SIZE, spill_dir=None):
+    # Coverage thresholds are compared exactly, so 0.98 means 49/50
+    if min_coverage is not None:
+        min_coverage = Fraction(str(min_coverage))
+    return best_hits(psl_records(f), itemgetter(9), score, ties=ties, coverage=psl_coverage, min_coverage=min_coverage, presorted=presorted, chunk_size=chunk_size, spill_dir=spill_dir)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('psl')
+    ap.add_argument('-o', '--output')
+    ap.add_argument('-s', '--score', choices=sorted(PSL_SCORES), default='matches')
+    ap.add_argument('-c', '--min-coverage', type=float, help='Minimum matches as a proportion of query size')
+    ap.add_argument('--ties', action='store_true', help='Report every alignment with the best score')
+    ap.add_argument('--unsorted', action='store_true', help='Alignments for a query may not be adjacent')
+    ap.add_argument('-T', '--temp-dir')
+    args = ap.parse_args()
+
+    output_h = open(args.output, 'w') if args.output is not None else sys.stdout
+    with open(args.psl) as psl_h:
+        for fields in best_psl_hits(psl_h, score=PSL_SCORES[args.score], ties=args.ties, min_coverage=args.min_coverage, presorted=not args.unsorted, spill_dir=args.temp_dir):
+            output_h.write('{}\n'.format('\t'.join(fields)))
+    if args.output is not None:
+        output_h.close()
+
+
+if __name__ == '__main__':
+    main()
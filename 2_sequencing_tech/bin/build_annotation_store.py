@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+import annotation
+import argparse
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-g', '--gtf', required=True)
+    args = ap.parse_args()
+
+    annotation.build_annotation_store(args.gtf)
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+import exon_coverage
+import argparse
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-g', '--gff', required=True)
+    args = ap.parse_args()
+
+    exon_coverage.build_exon_mask(args.gff)
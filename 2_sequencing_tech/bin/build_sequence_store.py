@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+import sequence_store
+import argparse
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-f', '--fasta', required=True)
+    args = ap.parse_args()
+
+    sequence_store.build_sequence_store(args.fasta)
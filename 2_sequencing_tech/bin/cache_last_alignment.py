@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+import last
+import argparse
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-a', '--alignment', required=True)
+    args = ap.parse_args()
+
+    last.build_alignment_cache(args.alignment)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import numpy
+import bam
+import transcript_coverage
+
+# Round-trip check of the BAM depth path of transcript_coverage.py on a small
+# random fixture.  A coordinate-sorted BAM file is written with bam.write_bam,
+# and the exonic depths read_bam_depths finds in it, through the index
+# written with it and through one built by bam.build_bai, are compared with
+# depths counted from the reads directly and, when samtools is installed,
+# from samtools depth.
+
+REFERENCES = [('chr1', 200000), ('chr2', 150000), ('chr3', 60000)]
+
+
+# A random CIGAR of about read_length read bases with an occasional
+# intron, deletion, insertion or soft clip
+def random_cigar(rng, read_length):
+    cigar = []
+    if rng.random() < 0.1:
+        cigar.append(('S', rng.randint(1, 10)))
+    aligned = rng.randint(20, read_length)
+    cigar.append(('M', aligned // 2))
+    operation = rng.choice(['N', 'N', 'D', 'I', None])
+    if operation == 'N':
+        cigar.append(('N', rng.randint(100, 40000)))
+    elif operation is not None:
+        cigar.append((operation, rng.randint(1, 5)))
+    cigar.append((rng.choice(['M', '=', 'X']), aligned - aligned // 2))
+    return cigar
+
+
+def random_records(rng, reads, read_length):
+    records = []
+    for i in range(reads):
+        ref_id = rng.randrange(len(REFERENCES))
+        # Room for the longest intron before the end of the reference
+        pos = rng.randrange(REFERENCES[ref_id][1] - 45000)
+        flag = rng.choice([0, 0, 0, 16, 0x100, 0x200, 0x400, 0x800])
+        cigar = random_cigar(rng, read_length) if rng.random() > 0.01 else []
+        records.append(('read{}'.format(i), flag, ref_id, pos, rng.randrange(61), cigar, 'A' * read_length))
+    records.sort(key=lambda record: (record[2], record[3]))
+    # Unmapped reads come last
+    records.extend(('unmapped{}'.format(i), 4, -1, -1, 0, [], 'A' * read_length) for i in range(10))
+    return records
+
+
+# Depths over the whole of each reference, counting the reads samtools depth
+# counts by default
+def expected_depths(records):
+    depths = [numpy.zeros(length, dtype=numpy.int64) for name, length in REFERENCES]
+    for name, flag, ref_id, pos, mapq, cigar, seq in records:
+        if ref_id < 0 or flag & bam.DEFAULT_FLAG_FILTER:
+            continue
+        for operation, length in cigar:
+            if operation in 'M=X':
+                depths[ref_id][pos:pos + length] += 1
+            if operation in 'MDN=X':
+                pos += length
+    return depths
+
+
+# Random exons, merged per reference, as ExonicBases
+def random_exonic_bases(rng, exons):
+    start_keys = []
+    end_keys = []
+    for ref_id, (name, length) in enumerate(REFERENCES):
+        starts = sorted(rng.randrange(length - 1000) for _ in range(exons))
+        merged = []
+        for start in starts:
+            end = start + rng.randint(50, 1000)
+            if len(merged) > 0 and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        start_keys.extend(transcript_coverage.position_keys(ref_id, start) for start, end in merged)
+        end_keys.extend(transcript_coverage.position_keys(ref_id, end) for start, end in merged)
+    start_keys = numpy.array(start_keys, dtype=numpy.int64)
+    end_keys = numpy.array(end_keys, dtype=numpy.int64)
+    offsets = numpy.concatenate(([0], numpy.cumsum(end_keys - start_keys)))
+    return transcript_coverage.ExonicBases({name: i for i, (name, length) in enumerate(REFERENCES)}, start_keys, end_keys, offsets)
+
+
+def exonic_depths(bases, reference_depths):
+    depth = numpy.zeros(len(bases), dtype=numpy.uint32)
+    for start_key, end_key, offset in zip(bases.start_keys.tolist(), bases.end_keys.tolist(), bases.offsets.tolist()):
+        depth[offset:offset + end_key - start_key] = reference_depths[start_key >> 32][start_key & 0xffffffff:end_key & 0xffffffff]
+    return depth
+
+
+def bam_depths(bam_fn, bases):
+    depth = numpy.zeros(len(bases), dtype=numpy.uint32)
+    transcript_coverage.read_bam_depths(bam_fn, bases, range(len(REFERENCES)), depth)
+    return depth
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-d', '--directory', required=True, help='Directory for the fixture files')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('-r', '--reads', type=int, default=20000)
+    ap.add_argument('-l', '--read-length', type=int, default=150)
+    ap.add_argument('-e', '--exons', type=int, default=200)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    records = random_records(rng, args.reads, args.read_length)
+    bases = random_exonic_bases(rng, args.exons)
+    expected = exonic_depths(bases, expected_depths(records))
+
+    os.makedirs(args.directory, exist_ok=True)
+    written_fn = os.path.join(args.directory, 'written.bam')
+    built_fn = os.path.join(args.directory, 'built.bam')
+    bam.write_bam(written_fn, REFERENCES, records)
+    bam.write_bam(built_fn, REFERENCES, records, index=False)
+    checks = [('written index', bam_depths(written_fn, bases)),
+              ('built index', bam_depths(built_fn, bases))]
+
+    if shutil.which('samtools') is not None:
+        depth_fn = os.path.join(args.directory, 'written.depth')
+        with open(depth_fn, 'wb') as depth_h:
+            subprocess.check_call(['samtools', 'depth', written_fn], stdout=depth_h)
+        depth = numpy.zeros(len(bases), dtype=numpy.uint32)
+        with open(depth_fn, 'rb') as depth_f:
+            transcript_coverage.read_depths(transcript_coverage.line_blocks(depth_f), bases, depth)
+        checks.append(('samtools depth', depth))
+    else:
+        print('samtools not found, so not compared with samtools depth')
+
+    failed = False
+    for name, depth in checks:
+        different = numpy.flatnonzero(depth != expected)
+        if len(different) > 0:
+            failed = True
+            print('{}: {} of {} exonic depths differ, first at exonic base {}'.format(name, len(different), len(expected), different[0]))
+        else:
+            print('{}: all {} exonic depths match'.format(name, len(expected)))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+import depth_matrix
+import argparse
+
+
+# Converts a transcript depth TSV file to a depth matrix, or a depth matrix
+# back to TSV
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-i', '--input', required=True)
+    ap.add_argument('-o', '--output', required=True)
+    args = ap.parse_args()
+
+    if depth_matrix.is_depth_matrix(args.input):
+        with open(args.output, 'wb') as output_h:
+            depth_matrix.write_depth_matrix_tsv(depth_matrix.load_depth_matrix(args.input), output_h)
+    else:
+        with open(args.input) as input_h:
+            depth_matrix.write_depth_matrix(args.output, depth_matrix.tsv_depth_rows(input_h))
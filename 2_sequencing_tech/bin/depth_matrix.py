@@ -0,0 +1,172 @@
+import attr
+import os
+import struct
+import numpy
+
+DEPTH_MATRIX_MAGIC = b'DEPTHMX\1'
+DEPTH_MATRIX_HEADER = struct.Struct('<8sQQ')
+TSV_BATCH_BASES = 1024 * 1024
+
+
+# A depth matrix holds the per-base depths of transcripts as one ragged
+# matrix: the depths of row i are depths[offsets[i]:offsets[i + 1]].  On disk
+# (<depths>.depths) it is a header (magic, row count, base count), the depths
+# as uint32, the row offsets as int64 aligned to 8 bytes, and the row names
+# one per line.  Depths come first so they can be streamed out before the
+# offsets and names are known, and both arrays are memory-mapped when loaded.
+@attr.s
+class DepthMatrix(object):
+    names = attr.ib()
+    offsets = attr.ib()
+    depths = attr.ib()
+    rows = attr.ib()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __getitem__(self, name):
+        row = self.rows[name]
+        return self.depths[self.offsets[row]:self.offsets[row + 1]]
+
+    def flush(self):
+        if isinstance(self.depths, numpy.memmap):
+            self.depths.flush()
+
+    # Views of the depths of the wanted rows that are in the matrix
+    def select(self, names):
+        return {name: self[name] for name in names if name in self.rows}
+
+
+def depth_matrix(names, offsets, depths):
+    return DepthMatrix(names, offsets, depths, {name: row for row, name in enumerate(names)})
+
+
+def offsets_start(bases):
+    return (DEPTH_MATRIX_HEADER.size + 4 * bases + 7) // 8 * 8
+
+
+def is_depth_matrix(fn):
+    with open(fn, 'rb') as f:
+        return f.read(len(DEPTH_MATRIX_MAGIC)) == DEPTH_MATRIX_MAGIC
+
+
+def load_depth_matrix(fn, mode='r'):
+    with open(fn, 'rb') as f:
+        magic, row_count, bases = DEPTH_MATRIX_HEADER.unpack(f.read(DEPTH_MATRIX_HEADER.size))
+        if magic != DEPTH_MATRIX_MAGIC:
+            raise ValueError('{} is not a depth matrix'.format(fn))
+        f.seek(offsets_start(bases) + 8 * (row_count + 1))
+        names = f.read().decode().split('\n')[:-1]
+    depths = numpy.memmap(fn, dtype='<u4', mode=mode, offset=DEPTH_MATRIX_HEADER.size, shape=(bases,)) if bases > 0 else numpy.zeros(0, dtype=numpy.uint32)
+    offsets = numpy.memmap(fn, dtype='<i8', mode='r', offset=offsets_start(bases), shape=(row_count + 1,))
+    return depth_matrix(names, offsets, depths)
+
+
+# Lays out a matrix for rows of the given lengths and opens it for writing,
+# with the depths zeroed
+def create_depth_matrix(fn, names, lengths):
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths, dtype=numpy.int64)))
+    with open(fn, 'wb') as f:
+        f.write(DEPTH_MATRIX_HEADER.pack(DEPTH_MATRIX_MAGIC, len(names), int(offsets[-1])))
+        f.truncate(offsets_start(int(offsets[-1])))
+        f.seek(offsets_start(int(offsets[-1])))
+        f.write(offsets.astype('<i8').tobytes())
+        f.write(''.join('{}\n'.format(name) for name in names).encode())
+    return load_depth_matrix(fn, mode='r+')
+
+
+# Streams (name, depths) rows into a matrix file
+def write_depth_matrix(fn, rows):
+    names = []
+    offsets = [0]
+    with open(fn, 'wb') as f:
+        f.write(bytes(DEPTH_MATRIX_HEADER.size))
+        for name, depths in rows:
+            names.append(name)
+            offsets.append(offsets[-1] + len(depths))
+            f.write(numpy.asarray(depths, dtype='<u4').tobytes())
+        f.write(bytes(offsets_start(offsets[-1]) - f.tell()))
+        f.write(numpy.array(offsets, dtype='<i8').tobytes())
+        f.write(''.join('{}\n'.format(name) for name in names).encode())
+        f.seek(0)
+        f.write(DEPTH_MATRIX_HEADER.pack(DEPTH_MATRIX_MAGIC, len(names), offsets[-1]))
+
+
+# Rows of a transcript_coverage.py TSV file: the transcript name, then one
+# depth per base
+def tsv_depth_rows(f, wanted=None):
+    for line in f:
+        name, _, depths = line.rstrip(os.linesep).partition('\t')
+        if wanted is not None and name not in wanted:
+            continue
+        yield(name, numpy.array(depths.split('\t'), dtype=numpy.uint32) if depths else numpy.zeros(0, dtype=numpy.uint32))
+
+
+def read_tsv_depth_matrix(fn, wanted=None):
+    names = []
+    rows = []
+    with open(fn) as f:
+        for name, depths in tsv_depth_rows(f, wanted):
+            names.append(name)
+            rows.append(depths)
+    offsets = numpy.concatenate(([0], numpy.cumsum([len(depths) for depths in rows], dtype=numpy.int64)))
+    return depth_matrix(names, offsets, numpy.concatenate(rows) if rows else numpy.zeros(0, dtype=numpy.uint32))
+
+
+# Depth matrices are memory-mapped; TSV files are parsed, keeping only the
+# wanted rows
+def depth_matrix_for(fn, wanted=None):
+    if is_depth_matrix(fn):
+        return load_depth_matrix(fn)
+    return read_tsv_depth_matrix(fn, wanted)
+
+
+# Decimal text of each value followed by its separator, and the offset of
+# the text of each value in the result.  Values are written right-aligned
+# into rows of a digit matrix, whose leading zeros are then dropped.
+def format_integers(values, separators):
+    values = numpy.asarray(values, dtype=numpy.uint32)
+    width = len(str(int(values.max()))) if len(values) > 0 else 1
+    rows = numpy.empty((len(values), width + 1), dtype=numpy.uint8)
+    rows[:, width] = separators
+    remaining = values.copy()
+    for column in range(width - 1, -1, -1):
+        rows[:, column] = remaining % 10 + ord('0')
+        remaining //= 10
+    digits = numpy.ones(len(values), dtype=numpy.int64)
+    for power in range(1, width):
+        digits += values >= 10 ** power
+    kept = numpy.arange(width + 1) >= (width - digits)[:, numpy.newaxis]
+    offsets = numpy.concatenate(([0], numpy.cumsum(digits + 1)))
+    return rows[kept].tobytes(), offsets
+
+
+# Writes TSV lines for rows given by their names, their lengths and their
+# concatenated depths
+def write_tsv_rows(names, lengths, depths, f):
+    base_offsets = numpy.concatenate(([0], numpy.cumsum(lengths, dtype=numpy.int64)))
+    # The depth of the last base of each row ends its line
+    separators = numpy.full(base_offsets[-1], ord('\t'), dtype=numpy.uint8)
+    separators[base_offsets[1:][base_offsets[1:] > base_offsets[:-1]] - 1] = ord('\n')
+    text, text_offsets = format_integers(depths, separators)
+    text_offsets = text_offsets[base_offsets].tolist()
+    lines = []
+    for i, name in enumerate(names):
+        lines.append(name.encode())
+        lines.append(b'\t')
+        lines.append(text[text_offsets[i]:text_offsets[i + 1]] if text_offsets[i + 1] > text_offsets[i] else b'\n')
+    f.write(b''.join(lines))
+
+
+# Rows are written in batches of roughly TSV_BATCH_BASES depths
+def write_depth_matrix_tsv(matrix, f):
+    offsets = numpy.asarray(matrix.offsets)
+    row_start = 0
+    while row_start < len(matrix):
+        row_end = int(numpy.searchsorted(offsets, offsets[row_start] + TSV_BATCH_BASES, side='right')) - 1
+        row_end = min(max(row_end, row_start + 1), len(matrix))
+        write_tsv_rows(matrix.names[row_start:row_end], numpy.diff(offsets[row_start:row_end + 1]), matrix.depths[offsets[row_start]:offsets[row_end]], f)
+        row_start = row_end
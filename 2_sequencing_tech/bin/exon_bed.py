@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+import annotation
+import argparse
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-g', '--gtf', required=True)
+    ap.add_argument('-o', '--output', required=True)
+    args = ap.parse_args()
+
+    with open(args.output, 'w') as output_h:
+        annotation.write_exon_bed(annotation.annotation_for(args.gtf), output_h)
@@ -0,0 +1,181 @@
+import attr
+import array
+import collections
+import numpy
+import annotation
+import array_cache
+import best_hits
+
+# Coverage of the genome by exons or aligned blocks is recorded as "deltas":
+# +1 at the start of an interval and -1 one past its end.  A delta table maps
+# each chromosome to a pair of int64 arrays, the positions and the steps
+# recorded there.  Integrating the steps over the sorted positions gives the
+# depth of every span between consecutive positions.
+
+# Patterns of which tables cover a span are int64 bitmasks, bit i for table i
+MAX_PATTERN_TABLES = 63
+
+EXON_MASK_VERSION = 1
+
+
+def delta_table():
+    return collections.defaultdict(lambda: (array.array('q'), array.array('q')))
+
+
+def add_delta(table, chrom, position, step):
+    positions, steps = table[chrom]
+    positions.append(position)
+    steps.append(step)
+
+
+# Convert a delta table to NumPy arrays sorted by position, which pickle
+# compactly when returned from worker processes
+def sorted_delta_table(table):
+    sorted_table = {}
+    for chrom, (positions, steps) in table.items():
+        positions = numpy.array(positions, dtype=numpy.int64)
+        order = numpy.argsort(positions, kind='mergesort')
+        sorted_table[chrom] = (positions[order], numpy.array(steps, dtype=numpy.int64)[order])
+    return sorted_table
+
+
+# Deltas for the aligned blocks of the best alignment of each query, provided
+# its matches are at least min_coverage of the query length
+def psl_block_deltas(fn, min_coverage=0.98):
+    table = delta_table()
+    with open(fn) as psl_h:
+        for best in best_hits.best_psl_hits(psl_h, min_coverage=min_coverage):
+            if int(best[17]) < 1:
+                continue
+            target = best[13]
+            block_sizes = map(int, best[18].rstrip(',').split(','))
+            t_starts = map(int, best[20].rstrip(',').split(','))
+            for block_start, block_size in zip(t_starts, block_sizes):
+                add_delta(table, target, block_start, 1)
+                add_delta(table, target, block_start + block_size, -1)
+    return sorted_delta_table(table)
+
+
+# Returns the sorted positions where any table has a delta on chrom and, for
+# each table, its depth over each span sites[j] .. sites[j + 1] - 1
+def site_depths(tables, chrom):
+    table_deltas = []
+    for table in tables:
+        positions, steps = table[chrom] if chrom in table else ([], [])
+        table_deltas.append((numpy.asarray(positions, dtype=numpy.int64), numpy.asarray(steps, dtype=numpy.int64)))
+    sites = numpy.unique(numpy.concatenate([positions for positions, steps in table_deltas]))
+    depths = []
+    for positions, steps in table_deltas:
+        site_steps = numpy.bincount(numpy.searchsorted(sites, positions), weights=steps, minlength=len(sites))
+        depths.append(numpy.cumsum(numpy.rint(site_steps).astype(numpy.int64)))
+    return sites, depths
+
+
+# Bases covered by each combination of tables, keyed by bitmask pattern
+def pattern_base_counts(tables):
+    if len(tables) > MAX_PATTERN_TABLES:
+        raise ValueError('At most {} coverage tables can be compared'.format(MAX_PATTERN_TABLES))
+    chroms = set()
+    for table in tables:
+        chroms.update(table.keys())
+
+    base_counts = collections.defaultdict(int)
+    for chrom in chroms:
+        sites, depths = site_depths(tables, chrom)
+        patterns = numpy.zeros(len(sites), dtype=numpy.int64)
+        for i, depth in enumerate(depths):
+            patterns |= (depth > 0).astype(numpy.int64) << i
+        span_patterns, span_index = numpy.unique(patterns[:-1], return_inverse=True)
+        span_bases = numpy.bincount(span_index, weights=numpy.diff(sites))
+        for pattern, bases in zip(span_patterns.tolist(), span_bases.tolist()):
+            base_counts[pattern] += int(round(bases))
+    return base_counts
+
+
+# The exons of an annotation reduce to the union of their intervals on each
+# chromosome, which gives the same exon/non-exon pattern at every base as the
+# full delta table.  Chromosome lengths come from ##sequence-region headers,
+# with -1 where there is none.  Each chromosome's runs are the slice
+# offsets[i]:offsets[i + 1] of the flat starts/ends arrays.
+@attr.s
+class ExonMask(object):
+    names = attr.ib()
+    lengths = attr.ib()
+    offsets = attr.ib()
+    starts = attr.ib()
+    ends = attr.ib()
+
+    # Deltas for the exon union, with a zero step at each known chromosome
+    # length.  Chromosomes whose renamed names collide are merged.
+    def delta_table(self, rename=None):
+        positions = collections.defaultdict(list)
+        steps = collections.defaultdict(list)
+        for i, name in enumerate(self.names):
+            if rename is not None:
+                name = rename(name)
+            starts = numpy.asarray(self.starts[self.offsets[i]:self.offsets[i + 1]])
+            ends = numpy.asarray(self.ends[self.offsets[i]:self.offsets[i + 1]])
+            positions[name].extend((starts, ends))
+            steps[name].extend((numpy.ones(len(starts), dtype=numpy.int64), -numpy.ones(len(ends), dtype=numpy.int64)))
+            if self.lengths[i] >= 0:
+                positions[name].append(numpy.array([self.lengths[i]], dtype=numpy.int64))
+                steps[name].append(numpy.zeros(1, dtype=numpy.int64))
+        table = {}
+        for name in positions:
+            chrom_positions = numpy.concatenate(positions[name])
+            order = numpy.argsort(chrom_positions, kind='mergesort')
+            table[name] = (chrom_positions[order], numpy.concatenate(steps[name])[order])
+        return table
+
+
+def compile_exon_mask(fn):
+    names = []
+    offsets = [0]
+    starts = []
+    ends = []
+    gene_annotation = annotation.annotation_for(fn)
+    for chromosome, chromosome_starts, chromosome_ends in gene_annotation.merged_exons():
+        names.append(chromosome)
+        starts.append(chromosome_starts)
+        ends.append(chromosome_ends)
+        offsets.append(offsets[-1] + len(chromosome_starts))
+    lengths = dict(zip(gene_annotation.chromosomes, gene_annotation.chromosome_lengths.tolist()))
+    return ExonMask(names,
+                    numpy.array([lengths[name] for name in names], dtype=numpy.int64),
+                    numpy.array(offsets, dtype=numpy.int64),
+                    numpy.concatenate(starts) if starts else numpy.zeros(0, dtype=numpy.int64),
+                    numpy.concatenate(ends) if ends else numpy.zeros(0, dtype=numpy.int64))
+
+
+# A compiled exon mask is stored as an array cache next to the annotation
+# (<annotation>.exons, see array_cache.py), so forked workers share its
+# pages read-only.
+EXON_MASK_ARRAYS = ['lengths', 'offsets', 'starts', 'ends']
+
+
+def exon_mask_path(fn):
+    return '{}.exons'.format(fn)
+
+
+def build_exon_mask(fn):
+    key = array_cache.source_key(fn, EXON_MASK_VERSION)
+    mask = compile_exon_mask(fn)
+    array_cache.write_array_cache(exon_mask_path(fn), key, {name: getattr(mask, name) for name in EXON_MASK_ARRAYS}, {'names': mask.names})
+    return load_exon_mask(fn)
+
+
+def load_exon_mask(fn):
+    cache = array_cache.load_array_cache(exon_mask_path(fn), array_cache.source_key(fn, EXON_MASK_VERSION), EXON_MASK_ARRAYS, ['names'])
+    if cache is None:
+        return None
+    arrays, name_lists = cache
+    return ExonMask(name_lists['names'], *(arrays[name] for name in EXON_MASK_ARRAYS))
+
+
+# Use a fresh compiled mask when there is one, otherwise take the exons from
+# the annotation store or the annotation itself
+def exon_mask_for(fn):
+    exon_mask = load_exon_mask(fn)
+    if exon_mask is None:
+        exon_mask = compile_exon_mask(fn)
+    return exon_mask
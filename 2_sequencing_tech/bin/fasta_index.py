@@ -0,0 +1,135 @@
+import attr
+import mmap
+import os
+
+# samtools faidx compatible indexes.  Each record of <fasta>.fai is the
+# sequence name, its length, the byte offset of its first base, and the bases
+# and bytes per line, so any range of a sequence is found without reading the
+# others.
+
+
+@attr.s
+class FaidxEntry(object):
+    length = attr.ib()
+    offset = attr.ib()
+    line_bases = attr.ib()
+    line_width = attr.ib()
+
+    # Byte offset of base i of the sequence
+    def base_offset(self, i):
+        return self.offset + i // self.line_bases * self.line_width + i % self.line_bases
+
+
+def fasta_index_path(fn):
+    return '{}.fai'.format(fn)
+
+
+def build_fasta_index(fn):
+    entries = []
+    with open(fn, 'rb') as fasta_h:
+        offset = 0
+        entry = None
+        # Lines after a short line must start a new record
+        short_line = False
+        for line in fasta_h:
+            if line[:1] == b'>':
+                if entry is not None:
+                    entries.append(entry)
+                name = line[1:].split()[0].decode() if line[1:].split() else ''
+                entry = [name, 0, offset + len(line), 0, 0]
+                short_line = False
+            elif entry is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                # Only the last line of the file can lack a line terminator,
+                # which is then taken to be a newline, as by samtools
+                terminator = len(line) - bases
+                if bases == 0:
+                    short_line = True
+                elif entry[3] == 0:
+                    entry[3] = bases
+                    entry[4] = bases + (terminator or 1)
+                elif short_line or bases > entry[3] or (terminator != 0 and terminator != entry[4] - entry[3]):
+                    raise ValueError('Different line lengths in sequence {} of {}'.format(entry[0], fn))
+                elif bases < entry[3]:
+                    short_line = True
+                entry[1] += bases
+            offset += len(line)
+        if entry is not None:
+            entries.append(entry)
+
+    # Write to a temporary file and rename it into place, so concurrent
+    # readers only ever see a complete index
+    index_path = fasta_index_path(fn)
+    tmp_path = '{}.tmp{}'.format(index_path, os.getpid())
+    with open(tmp_path, 'w') as index_h:
+        for name, length, sequence_offset, line_bases, line_width in entries:
+            index_h.write('{}\t{}\t{}\t{}\t{}\n'.format(name, length, sequence_offset, line_bases, line_width))
+    os.rename(tmp_path, index_path)
+    return load_fasta_index(fn)
+
+
+# An index older than its FASTA file is stale, as for samtools
+def load_fasta_index(fn):
+    index_path = fasta_index_path(fn)
+    try:
+        if os.stat(index_path).st_mtime_ns < os.stat(fn).st_mtime_ns:
+            return None
+        entries = {}
+        with open(index_path) as index_h:
+            for line in index_h:
+                sp_line = line.rstrip(os.linesep).split('\t')
+                entries[sp_line[0]] = FaidxEntry(*(int(field) for field in sp_line[1:5]))
+    except (OSError, ValueError, IndexError):
+        return None
+    return entries
+
+
+def fasta_index_for(fn):
+    entries = load_fasta_index(fn)
+    if entries is None:
+        entries = build_fasta_index(fn)
+    return entries
+
+
+# Sequences of a FASTA file read through its index from a memory map, so only
+# the pages holding requested bases are touched
+@attr.s
+class IndexedFasta(object):
+    entries = attr.ib()
+    data = attr.ib()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def length(self, name):
+        return self.entries[name].length
+
+    # Bases [start, end) of a sequence, with end clipped to its length
+    def fetch_bytes(self, name, start=0, end=None):
+        entry = self.entries[name]
+        end = entry.length if end is None else min(end, entry.length)
+        if start >= end:
+            return b''
+        text = self.data[entry.base_offset(start):entry.base_offset(end - 1) + 1]
+        return text.replace(b'\n', b'').replace(b'\r', b'')
+
+    def fetch(self, name, start=0, end=None):
+        return self.fetch_bytes(name, start, end).decode()
+
+    # The wanted sequences that are in the file
+    def sequences(self, names):
+        return {name: self.fetch(name) for name in names if name in self.entries}
+
+
+def open_indexed_fasta(fn):
+    entries = fasta_index_for(fn)
+    with open(fn, 'rb') as fasta_h:
+        data = mmap.mmap(fasta_h.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(fasta_h.fileno()).st_size > 0 else b''
+    return IndexedFasta(entries, data)
+
+
+def fetch_sequences(fn, names):
+    return open_indexed_fasta(fn).sequences(names)
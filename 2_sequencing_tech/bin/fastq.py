@@ -0,0 +1,125 @@
+# Paired FastQ files with four-line records and both mates in the same order.
+# Files are read as bytes in large blocks that are split into records with
+# NumPy, and a read-pair is (name, record1, record2, bases, bases1), with the
+# bases of both mates and of the first mate.  Read names are taken from the
+# header with any /1 or /2 suffix or comment removed, and the two mates of
+# every pair must have the same name.
+#
+# Records are written as @<name>/1 (or /2), sequence, + and quality lines.
+# Records already in that form are memoryview slices of the input block, so
+# selected records are copied only into the output buffer.
+
+import numpy
+
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def open_output(fn, mode='wb'):
+    return open(fn, mode, buffering=WRITE_BUFFER_SIZE)
+
+
+# The byte offsets of the newlines of the complete records of a block, one
+# row of four per record
+def record_newlines(data):
+    text = numpy.frombuffer(data, dtype=numpy.uint8)
+    newlines = numpy.flatnonzero(text == ord('\n'))
+    return text, newlines[:len(newlines) // 4 * 4].reshape(-1, 4)
+
+
+# Splits the complete records of a block of one file of a pair, returning
+# their names, records and bases, and the offset after the last of them.
+# Newlines are found for the whole block at once; only records not already
+# in output form are rewritten one at a time.
+def block_records(data, mate):
+    text, newlines = record_newlines(data)
+    if len(newlines) == 0:
+        return [], [], [], 0
+    header_ends, seq_ends, plus_ends, ends = newlines.T
+    ends = ends + 1
+    starts = numpy.concatenate(([0], ends[:-1]))
+    canonical = ((text[header_ends - 2] == ord('/')) & (text[header_ends - 1] == ord(str(mate))) &
+                 (plus_ends == seq_ends + 2) & (text[seq_ends + 1] == ord('+')) &
+                 (text[seq_ends - 1] > 32) & (text[ends - 2] > 32))
+    # Headers with a space, found from the line each space is on
+    space_lines = numpy.searchsorted(newlines.ravel(), numpy.flatnonzero(text[:ends[-1]] == ord(' ')))
+    canonical[space_lines[space_lines % 4 == 0] // 4] = False
+
+    view = memoryview(data)
+    starts = starts.tolist()
+    ends = ends.tolist()
+    header_ends = header_ends.tolist()
+    names = [data[start + 1:header_end - 2] for start, header_end in zip(starts, header_ends)]
+    records = [view[start:end] for start, end in zip(starts, ends)]
+    bases = (seq_ends - newlines[:, 0] - 1).tolist()
+    suffix = '/{}'.format(mate).encode()
+    for i in numpy.flatnonzero(~canonical).tolist():
+        header = data[starts[i] + 1:header_ends[i]].rstrip()
+        names[i] = header.rsplit(b'/', 1)[0].rsplit(b' ', 1)[0]
+        seq = data[header_ends[i] + 1:seq_ends[i]].rstrip()
+        qual = data[plus_ends[i] + 1:ends[i] - 1].rstrip()
+        records[i] = b''.join([b'@', names[i], suffix, b'\n', seq, b'\n+\n', qual, b'\n'])
+        bases[i] = len(seq)
+    return names, records, bases, ends[-1]
+
+
+# Yields the names, records and bases of the records of each block of one
+# file of a pair, up to byte offset end
+def mate_batches(f, mate, end=None, block_size=READ_BLOCK_SIZE):
+    data = b''
+    while True:
+        block = f.read(block_size if end is None else min(block_size, end - f.tell()))
+        if not block:
+            # A last record without a final newline
+            if not data.strip():
+                return
+            data += b'\n'
+        elif data:
+            data += block
+        else:
+            data = block
+        names, records, bases, records_end = block_records(data, mate)
+        yield(names, records, bases)
+        data = data[records_end:]
+        if not block:
+            return
+
+
+# Read-pairs are matched a batch at a time: as many records as both files
+# have left in their current blocks, with their names compared as lists.
+# Reading starts at the byte offsets start of the two files, which must be
+# the starts of the same read-pair, and stops at the offsets end.
+def read_pairs(fn1, fn2, start=(0, 0), end=(None, None)):
+    with open(fn1, 'rb') as f1, open(fn2, 'rb') as f2:
+        f1.seek(start[0])
+        f2.seek(start[1])
+        batches1 = mate_batches(f1, 1, end[0])
+        batches2 = mate_batches(f2, 2, end[1])
+        names1, records1, bases1 = [], [], []
+        names2, records2, bases2 = [], [], []
+        number = 0
+        while True:
+            if not names1:
+                names1, records1, bases1 = next(batches1, ([], [], []))
+            if not names2:
+                names2, records2, bases2 = next(batches2, ([], [], []))
+            count = min(len(names1), len(names2))
+            if count == 0:
+                return
+            if names1[:count] != names2[:count]:
+                for i in range(count):
+                    if names1[i] != names2[i]:
+                        raise ValueError('Read {} of {} is {} but of {} is {}'.format(number + i + 1, fn1, names1[i].decode(), fn2, names2[i].decode()))
+            yield from zip(names1[:count], records1[:count], records2[:count], [bases + mate_bases for bases, mate_bases in zip(bases1[:count], bases2[:count])], bases1[:count])
+            names1, records1, bases1 = names1[count:], records1[count:], bases1[count:]
+            names2, records2, bases2 = names2[count:], records2[count:], bases2[count:]
+            number += count
+
+
+def pair_bases(pair):
+    return pair[3]
+
+
+def write_pair(f1, f2, pair):
+    f1.write(pair[1])
+    f2.write(pair[2])
@@ -0,0 +1,128 @@
+import attr
+import os
+import numpy
+import fastq
+
+# FastQ sidecar indexes (<fastq>.fqi).  The first line holds the number of
+# reads and bases of the file and the checkpoint interval; each following
+# line is a checkpoint, every interval records from the first: the record
+# number, the bases before it, and its byte offset.  Totals are then read
+# without scanning the file, and readers can start at any checkpoint.
+
+FASTQ_INDEX_INTERVAL = 100000
+
+
+@attr.s
+class FastqIndex(object):
+    reads = attr.ib()
+    bases = attr.ib()
+    interval = attr.ib()
+    records = attr.ib()
+    bases_before = attr.ib()
+    offsets = attr.ib()
+
+    # The last checkpoint at or before a record
+    def checkpoint(self, record):
+        i = min(record // self.interval, len(self.records) - 1)
+        return int(self.records[i]), int(self.bases_before[i]), int(self.offsets[i])
+
+    # Checkpoints dividing the file into up to part_count parts of about the
+    # same number of bases, as (first checkpoint, end checkpoint) pairs, the
+    # end being None for the end of the file
+    def parts(self, part_count):
+        if len(self.records) == 0:
+            return []
+        bounds = numpy.searchsorted(self.bases_before, numpy.arange(part_count) * self.bases / part_count)
+        bounds = numpy.unique(numpy.minimum(bounds, len(self.records) - 1)).tolist()
+        return list(zip(bounds, bounds[1:] + [None]))
+
+
+def fastq_index_path(fn):
+    return '{}.fqi'.format(fn)
+
+
+def build_fastq_index(fn, interval=FASTQ_INDEX_INTERVAL):
+    reads = 0
+    bases = 0
+    checkpoints = []
+    with open(fn, 'rb') as fastq_h:
+        offset = 0
+        data = b''
+        while True:
+            block = fastq_h.read(fastq.READ_BLOCK_SIZE)
+            at_end = not block
+            if at_end:
+                if not data.strip():
+                    break
+                # A last record without a final newline
+                block = b'\n'
+            data += block
+            text, newlines = fastq.record_newlines(data)
+            if len(newlines) > 0:
+                starts = numpy.concatenate(([0], newlines[:-1, 3] + 1))
+                record_bases = newlines[:, 1] - newlines[:, 0] - 1
+                bases_before = bases + numpy.concatenate(([0], numpy.cumsum(record_bases[:-1])))
+                first = -reads % interval
+                for i in range(first, len(newlines), interval):
+                    checkpoints.append((reads + i, int(bases_before[i]), offset + int(starts[i])))
+                reads += len(newlines)
+                bases += int(record_bases.sum())
+                end = int(newlines[-1, 3]) + 1
+                offset += end
+                data = data[end:]
+            if at_end:
+                break
+
+    write_fastq_index(fn, reads, bases, interval, checkpoints)
+    return load_fastq_index(fn)
+
+
+# Writes the index of a FastQ file from its totals and (record, bases before,
+# offset) checkpoints, for tools that count them while writing the file
+def write_fastq_index(fn, reads, bases, interval, checkpoints):
+    # Write to a temporary file and rename it into place, so concurrent
+    # readers only ever see a complete index
+    index_path = fastq_index_path(fn)
+    tmp_path = '{}.tmp{}'.format(index_path, os.getpid())
+    with open(tmp_path, 'w') as index_h:
+        index_h.write('{}\t{}\t{}\n'.format(reads, bases, interval))
+        index_h.write(''.join('{}\t{}\t{}\n'.format(*checkpoint) for checkpoint in checkpoints))
+    os.rename(tmp_path, index_path)
+
+
+# An index older than its FastQ file is stale
+def load_fastq_index(fn):
+    index_path = fastq_index_path(fn)
+    try:
+        if os.stat(index_path).st_mtime_ns < os.stat(fn).st_mtime_ns:
+            return None
+        with open(index_path) as index_h:
+            reads, bases, interval = (int(field) for field in index_h.readline().split('\t'))
+            checkpoints = numpy.array([line.rstrip(os.linesep).split('\t') for line in index_h], dtype=numpy.int64).reshape(-1, 3)
+    except (OSError, ValueError):
+        return None
+    return FastqIndex(reads, bases, interval, checkpoints[:, 0], checkpoints[:, 1], checkpoints[:, 2])
+
+
+def fastq_index_for(fn):
+    index = load_fastq_index(fn)
+    if index is None:
+        index = build_fastq_index(fn)
+    return index
+
+
+# Byte ranges of a FastQ pair, as (start, end) offset pairs for
+# fastq.read_pairs, dividing it into up to part_count parts at checkpoints
+def pair_ranges(fn1, fn2, part_count):
+    index1 = fastq_index_for(fn1)
+    index2 = fastq_index_for(fn2)
+    if index1.reads != index2.reads or index1.interval != index2.interval:
+        raise ValueError('The indexes of {} and {} have different numbers of reads or checkpoint intervals'.format(fn1, fn2))
+    if index1.reads == 0:
+        return [((0, 0), (None, None))]
+    ranges = []
+    for first, end in index1.parts(part_count):
+        start = (int(index1.offsets[first]), int(index2.offsets[first]))
+        stop = (None, None) if end is None else (int(index1.offsets[end]), int(index2.offsets[end]))
+        ranges.append((start, stop))
+    return ranges
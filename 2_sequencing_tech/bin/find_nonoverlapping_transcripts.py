@@ -1,9 +1,8 @@
 #!/usr/bin/env python3
 
-import sys
-import os
 import argparse
-from collections import defaultdict, Counter
+import numpy
+import annotation
 
 
 if __name__ == '__main__':
@@ -12,49 +11,27 @@ if __name__ == '__main__':
     ap.add_argument('-o', '--output-file', required=True)
     args = ap.parse_args()
 
-    chrom_exon_cov = defaultdict(Counter)
-    with open(args.gtf_file) as gtf_h:
-        for line in gtf_h:
-            if line.startswith('#'):
-                continue
-            sp_line = line.rstrip(os.linesep).split('\t')
-            chrom = sp_line[0]
-            entry_type = sp_line[2]
-            if entry_type != 'exon':
-                continue
+    gene_annotation = annotation.annotation_for(args.gtf_file)
+    exon_chromosome = numpy.asarray(gene_annotation.exon_chromosome)
+    exon_starts = numpy.asarray(gene_annotation.exon_starts)
+    exon_ends = numpy.asarray(gene_annotation.exon_ends)
+
+    # An exon is a duplicate if any of its bases is in more than one exon
+    duplicate_exons = numpy.zeros(len(exon_starts), dtype=bool)
+    for chromosome_id in range(len(gene_annotation.chromosomes)):
+        rows = numpy.flatnonzero((exon_chromosome == chromosome_id) & (exon_ends > exon_starts))
+        starts = exon_starts[rows]
+        ends = exon_ends[rows]
+        sites, site_index = numpy.unique(numpy.concatenate((starts, ends)), return_inverse=True)
+        steps = numpy.concatenate((numpy.ones(len(rows), dtype=numpy.int64), -numpy.ones(len(rows), dtype=numpy.int64)))
+        exon_cov = numpy.cumsum(numpy.bincount(site_index, weights=steps, minlength=len(sites)))
+        multiple = numpy.concatenate(([0], numpy.cumsum(exon_cov > 1.5)))
+        duplicate_exons[rows] = multiple[numpy.searchsorted(sites, ends)] > multiple[numpy.searchsorted(sites, starts)]
+
+    exon_transcript = numpy.repeat(numpy.arange(len(gene_annotation.transcripts)), numpy.diff(gene_annotation.exon_offsets))
+    duplicate_transcripts = numpy.bincount(exon_transcript[duplicate_exons], minlength=len(gene_annotation.transcripts)) > 0
 
-            start = int(sp_line[3])
-            end = int(sp_line[4])
-
-            chrom_exon_cov[chrom].update(range(start, end + 1))
-
-    all_transcripts = set()
-    duplicate_transcripts = set()
-    with open(args.gtf_file) as gtf_h:
-        for line in gtf_h:
-            if line.startswith('#'):
-                continue
-            sp_line = line.rstrip(os.linesep).split('\t')
-            chrom = sp_line[0]
-            entry_type = sp_line[2]
-            if entry_type != 'exon':
-                continue
-
-            try:
-                additional_info = {key: value[1:-1] for key, value in (entry.strip().split(' ') for entry in sp_line[8].split(';')[:-1])}
-            except:
-                sys.stderr.write(f'{line}\n')
-                sys.exit(1)
-            transcript = additional_info['transcript_id']
-            start = int(sp_line[3])
-            end = int(sp_line[4])
-            exon_cov = (chrom_exon_cov[chrom][idx] for idx in range(start, end + 1))
-            duplicate = any((chrom_exon_cov[chrom][idx] > 1 for idx in range(start, end + 1)))
-            if duplicate:
-                duplicate_transcripts.add(transcript)
-            all_transcripts.add(transcript)
-
-    wanted_transcripts = all_transcripts - duplicate_transcripts
     with open(args.output_file, 'w') as output_h:
-        for transcript in wanted_transcripts:
-            output_h.write(f'{transcript}\n')
+        for transcript, duplicate in zip(gene_annotation.transcripts, duplicate_transcripts.tolist()):
+            if not duplicate:
+                output_h.write(f'{transcript}\n')
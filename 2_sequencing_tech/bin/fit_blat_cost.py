@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import numpy
+
+
+# Runtime of each part of a split_fasta.py parts file from its Snakemake
+# benchmark file (<benchmark_dir>/<part>.txt), with the records and bases of
+# the part.  Parts without a benchmark are skipped.
+def part_runtimes(parts_fn, benchmark_dir):
+    with open(parts_fn) as parts_h:
+        for line in parts_h:
+            part, records, bases = line.rstrip(os.linesep).split('\t')
+            benchmark_fn = os.path.join(benchmark_dir, '{}.txt'.format(part))
+            if not os.path.exists(benchmark_fn):
+                continue
+            with open(benchmark_fn) as benchmark_h:
+                header = benchmark_h.readline().rstrip(os.linesep).split('\t')
+                seconds = float(benchmark_h.readline().rstrip(os.linesep).split('\t')[header.index('s')])
+            yield(int(records), int(bases), seconds)
+
+
+# Least squares fit of blat runtime as intercept + per_record * records +
+# per_base * bases
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-s', '--split', nargs=2, action='append', required=True, metavar=('PARTS', 'BENCHMARK_DIR'))
+    ap.add_argument('-o', '--output', required=True)
+    args = ap.parse_args()
+
+    runtimes = numpy.array([runtime for parts_fn, benchmark_dir in args.split for runtime in part_runtimes(parts_fn, benchmark_dir)], dtype=numpy.float64)
+    if len(runtimes) < 3:
+        raise ValueError('At least 3 benchmarked parts are needed to fit a cost model, found {}'.format(len(runtimes)))
+    design = numpy.column_stack((numpy.ones(len(runtimes)), runtimes[:, 0], runtimes[:, 1]))
+    coefficients = numpy.linalg.lstsq(design, runtimes[:, 2], rcond=None)[0]
+
+    with open(args.output, 'w') as out_h:
+        out_h.write('intercept\tper_record\tper_base\n')
+        out_h.write('{}\n'.format('\t'.join(str(coefficient) for coefficient in coefficients.tolist())))
+
+
+if __name__ == '__main__':
+    main()
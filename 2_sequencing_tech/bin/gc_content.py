@@ -0,0 +1,92 @@
+import multiprocessing
+import numpy
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+
+FASTA_CHUNK_SIZE = 1000
+
+GC_BASES = numpy.zeros(256, dtype=bool)
+GC_BASES[[ord('G'), ord('C'), ord('g'), ord('c')]] = True
+
+
+# G/C counts of every window of a sequence come from one cumulative sum of a
+# G/C indicator, so any number of window sizes cost one pass over the
+# sequence.  gc_sums[i] is the number of G/C bases before position i.
+def gc_sums(seq):
+    if isinstance(seq, str):
+        seq = seq.encode()
+    return numpy.concatenate(([0], numpy.cumsum(GC_BASES[numpy.frombuffer(seq, dtype=numpy.uint8)], dtype=numpy.int64)))
+
+
+# GC fraction of each window of a sequence with the given prefix sums.  A
+# sequence shorter than the window is one window of its own length, and an
+# empty sequence has a GC fraction of 0.
+def window_gc(sums, window):
+    length = len(sums) - 1
+    if length == 0:
+        return numpy.zeros(1)
+    if length < window:
+        return numpy.array([sums[-1] / length])
+    return (sums[window:] - sums[:-window]) / window
+
+
+def seq_gc_content(seq):
+    sums = gc_sums(seq)
+    if len(sums) == 1:
+        return 0.0
+    return int(sums[-1]) / (len(sums) - 1)
+
+
+# GC fractions of every kmer_size window, or of the whole sequence when it is
+# shorter than a window but at least min_size long
+def kmer_gc_frequencies(seq, kmer_size, min_size):
+    return sums_kmer_gc_frequencies(gc_sums(seq), kmer_size, min_size)
+
+
+def sums_kmer_gc_frequencies(sums, kmer_size, min_size):
+    length = len(sums) - 1
+    if kmer_size > length and length < min_size:
+        return numpy.zeros(0)
+    return window_gc(sums, kmer_size)
+
+
+# Per-window GC fractions of a sequence for each window size
+def scan_gc(seq, windows):
+    sums = gc_sums(seq)
+    return {window: window_gc(sums, window) for window in windows}
+
+
+# Maximum and mean window GC of a sequence for each window size
+def gc_stats(seq, windows):
+    stats = {}
+    for window, fractions in scan_gc(seq, windows).items():
+        stats[window] = (float(fractions.max()), float(fractions.mean()))
+    return stats
+
+
+def chunk_gc_stats(task):
+    chunk, windows = task
+    return [(name, gc_stats(seq, windows)) for name, seq in chunk]
+
+
+def fasta_chunks(f, chunk_size=FASTA_CHUNK_SIZE):
+    chunk = []
+    for title, seq in SimpleFastaParser(f):
+        chunk.append((title.split()[0], seq))
+        if len(chunk) == chunk_size:
+            yield(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        yield(chunk)
+
+
+# Yields the name and window GC stats of each FASTA record, in file order,
+# spreading chunks of records over processes
+def fasta_gc_stats(f, windows, processes=1):
+    tasks = ((chunk, windows) for chunk in fasta_chunks(f))
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            for chunk_stats in pool.imap(chunk_gc_stats, tasks):
+                yield from chunk_stats
+    else:
+        for task in tasks:
+            yield from chunk_gc_stats(task)
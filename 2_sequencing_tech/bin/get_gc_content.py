@@ -1,28 +1,20 @@
 #!/usr/bin/env python3
 
 import sys
-from Bio.SeqIO.FastaIO import SimpleFastaParser
-from collections import Counter
+import argparse
+import gc_content
 
 
-def max_kmer_gc(seq, kmer_size):
-    current_count = Counter(seq[0:kmer_size])
-    max_gc_freq = (current_count['G'] + current_count['C']) / float(sum(current_count.values()))
-    for i in range(kmer_size, len(seq)):
-        current_count[seq[i - kmer_size]] -= 1
-        current_count[seq[i]] += 1
-        current_gc_freq = (current_count['G'] + current_count['C']) / float(sum(current_count.values()))
-        max_gc_freq = max(current_gc_freq, max_gc_freq)
-    return max_gc_freq
+# The maximum GC of the windows of each transcript, one column per window
+# size
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('fasta')
+    ap.add_argument('-w', '--window', type=int, action='append')
+    ap.add_argument('-p', '--processes', type=int, default=1)
+    args = ap.parse_args()
 
-
-def seq_gc(seq):
-        seq = seq.upper()
-        count = Counter(seq)
-        return (count['G'] + count['C']) / float(sum(count.values()))
-
-
-with open(sys.argv[1]) as fasta_f:
-    for title, seq in SimpleFastaParser(fasta_f):
-        sp_title = title.split()
-        sys.stdout.write("{}\t{}\n".format(sp_title[0], max_kmer_gc(seq, 100)))
+    windows = args.window if args.window is not None else [100]
+    with open(args.fasta) as fasta_f:
+        for name, stats in gc_content.fasta_gc_stats(fasta_f, windows, args.processes):
+            sys.stdout.write('{}\t{}\n'.format(name, '\t'.join(str(stats[window][0]) for window in windows)))
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+import fastq_index
+import argparse
+
+
+# Builds the sidecar index of each FastQ file, optionally printing its read
+# and base totals
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('fastq', nargs='+')
+    ap.add_argument('-i', '--interval', type=int, default=fastq_index.FASTQ_INDEX_INTERVAL)
+    ap.add_argument('-t', '--totals', action='store_true', help='Print the reads and bases of each file')
+    args = ap.parse_args()
+
+    for fn in args.fastq:
+        index = fastq_index.build_fastq_index(fn, args.interval)
+        if args.totals:
+            print(index.reads, index.bases)
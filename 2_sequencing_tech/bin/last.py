@@ -1,7 +1,37 @@
 import attr
+import array_cache
+import best_hits
+import depth_matrix
 import os
 import array
-from collections import defaultdict, Counter
+import gzip
+import multiprocessing
+import queue
+import threading
+import numpy
+from collections import defaultdict
+from operator import attrgetter
+
+
+DECOMPRESS_BUFFER_SIZE = 16 * 1024 * 1024
+DECOMPRESS_BUFFER_COUNT = 4
+ALIGNMENT_CACHE_VERSION = 1
+ALIGNMENT_CACHE_COLUMNS = {
+    'score': numpy.int64,
+    'subject_id': numpy.int32,
+    'subject_start': numpy.int64,
+    'subject_length': numpy.int64,
+    'query_id': numpy.int32,
+    'query_start': numpy.int64,
+    'query_strand': numpy.uint8,
+    'query_length': numpy.int64,
+    'query_alignment_proportion': numpy.float64,
+    'subject_alignment_proportion': numpy.float64,
+    'gapless_alignment_size': numpy.int64,
+}
+GAP = ord('-')
+UPPER_N = ord('N')
+LOWER_N = ord('n')
 
 
 @attr.s
@@ -24,9 +54,153 @@ class LastEntry(object):
     query_alignment_proportion = attr.ib()
     subject_alignment_proportion = attr.ib()
     gapless_alignment_size = attr.ib()
+    blocks = attr.ib()
 
 
-def last_entries(f):
+# Records for whole-transcriptome MAF files.  Subject and query names are
+# interned to integer IDs in a NameTable shared by all records of a parse, and
+# the alignment strings are dropped once the gapless blocks are extracted.
+@attr.s(slots=True)
+class CompactLastEntry(object):
+    names = attr.ib(repr=False)
+    score = attr.ib()
+    subject_id = attr.ib()
+    subject_start = attr.ib()
+    subject_length = attr.ib()
+    query_id = attr.ib()
+    query_start = attr.ib()
+    query_strand = attr.ib()
+    query_length = attr.ib()
+    query_alignment_proportion = attr.ib()
+    subject_alignment_proportion = attr.ib()
+    gapless_alignment_size = attr.ib()
+    blocks = attr.ib()
+
+    @property
+    def subject(self):
+        return self.names.names[self.subject_id]
+
+    @property
+    def query(self):
+        return self.names.names[self.query_id]
+
+
+@attr.s(slots=True)
+class NameTable(object):
+    ids = attr.ib(default=attr.Factory(dict))
+    names = attr.ib(default=attr.Factory(list))
+
+    def intern(self, name):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+
+# Gapless blocks are the runs of alignment columns with no gap in either
+# sequence, stored as (subject offset, length) pairs.  The gapless alignment
+# size counts the columns of those blocks where the query base is not N.
+def alignment_blocks(subject_start, subject_align_string, query_align_string):
+    if '-' not in subject_align_string and '-' not in query_align_string:
+        alignment_length = len(query_align_string) - query_align_string.count('N') - query_align_string.count('n')
+        return ((subject_start, len(subject_align_string)),), alignment_length
+    subject_bases = numpy.frombuffer(subject_align_string.encode('ascii'), dtype=numpy.uint8) != GAP
+    query_codes = numpy.frombuffer(query_align_string.encode('ascii'), dtype=numpy.uint8)
+    aligned = subject_bases & (query_codes != GAP)
+    alignment_length = int(numpy.count_nonzero(aligned & (query_codes != UPPER_N) & (query_codes != LOWER_N)))
+    edges = numpy.diff(numpy.concatenate(([False], aligned, [False])).astype(numpy.int8))
+    run_starts = numpy.flatnonzero(edges == 1)
+    run_ends = numpy.flatnonzero(edges == -1)
+    subject_offsets = subject_start + numpy.cumsum(subject_bases) - 1
+    blocks = tuple(zip(subject_offsets[run_starts].tolist(), (run_ends - run_starts).tolist()))
+    return blocks, alignment_length
+
+
+# Line iterator over a compressed binary stream.  A background thread
+# decompresses into a small pool of large buffers which are handed back once
+# the parser has split them into lines, so decompression and parsing overlap.
+class ThreadedDecompressReader(object):
+    def __init__(self, raw, buffer_size=DECOMPRESS_BUFFER_SIZE, buffer_count=DECOMPRESS_BUFFER_COUNT):
+        self.raw = raw
+        self.closed = False
+        self.free_buffers = queue.Queue()
+        self.filled_buffers = queue.Queue()
+        for _ in range(buffer_count):
+            self.free_buffers.put(bytearray(buffer_size))
+        self.lines = self.read_lines()
+        self.thread = threading.Thread(target=self.fill_buffers, daemon=True)
+        self.thread.start()
+
+    def fill_buffers(self):
+        try:
+            while True:
+                buffer = self.free_buffers.get()
+                if self.closed:
+                    break
+                size = self.raw.readinto(buffer)
+                self.filled_buffers.put((buffer, size))
+                if size == 0:
+                    break
+        except Exception as e:
+            self.filled_buffers.put((e, 0))
+
+    def read_lines(self):
+        partial_line = ''
+        while True:
+            buffer, size = self.filled_buffers.get()
+            if isinstance(buffer, Exception):
+                raise buffer
+            if size == 0:
+                break
+            # Lines end at '\n' only; str.splitlines would also split at '\r',
+            # '\x0b', '\x1c' and the like within a line
+            lines = (partial_line + str(memoryview(buffer)[:size], 'ascii')).split('\n')
+            self.free_buffers.put(buffer)
+            partial_line = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial_line:
+            yield partial_line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.lines)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.free_buffers.put(bytearray(0))
+        self.thread.join()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_compressed(fn):
+    return fn.endswith(('.gz', '.zstd', '.zst'))
+
+
+def open_alignment(fn):
+    if fn.endswith('.gz'):
+        return ThreadedDecompressReader(gzip.open(fn, 'rb'))
+    elif fn.endswith(('.zstd', '.zst')):
+        import zstandard
+        raw = zstandard.ZstdDecompressor().stream_reader(open(fn, 'rb'), read_across_frames=True, closefd=True)
+        return ThreadedDecompressReader(raw)
+    return open(fn)
+
+
+def last_entries(f, compact=False):
+    names = NameTable()
     for line in f:
         if line[0] != 'a':
             continue
@@ -34,180 +208,327 @@ def last_entries(f):
         sp_lines.append(next(f).rstrip(os.linesep).split())
         sp_lines.append(next(f).rstrip(os.linesep).split())
         score = int(sp_lines[0][1].split('=')[1])
-        eg2 = float(sp_lines[0][2].split('=')[1])
-        e = float(sp_lines[0][3].split('=')[1])
         subject = sp_lines[1][1]
         subject_start = int(sp_lines[1][2])
-        subject_align_length = int(sp_lines[1][3])
-        subject_strand = sp_lines[1][4]
         subject_length = int(sp_lines[1][5])
         subject_align_string = sp_lines[1][6]
         query = sp_lines[2][1]
         query_start = int(sp_lines[2][2])
-        query_align_length = int(sp_lines[2][3])
         query_strand = sp_lines[2][4]
         query_length = int(sp_lines[2][5])
         query_align_string = sp_lines[2][6]
-        alignment_length = 0
-        for qbase, sbase in zip(query_align_string, subject_align_string):
-            if qbase != '-' and qbase != 'N' and qbase != 'n' and sbase != '-':
-                alignment_length += 1
-        yield(LastEntry(score, eg2, e, subject, subject_start, subject_align_length, subject_strand, subject_length, subject_align_string, query, query_start, query_align_length, query_strand, query_length, query_align_string, alignment_length / float(query_length), alignment_length / float(subject_length), alignment_length))
-
-
-def best_last_entries(f):
-    group = []
-    prev_query = ""
-    multi_count = 0
-    for last_entry in last_entries(f):
-        query_name = last_entry.query
-        if query_name != prev_query:
-            if len(group) > 0:
-                if len(group) > 1:
-                    multi_count += 1
-                group.sort(key=lambda x: x.subject_alignment_proportion, reverse=True)
-                group.sort(key=lambda x: x.query_alignment_proportion, reverse=True)
-                group.sort(key=lambda x: x.score, reverse=True)
-                best_score = group[0].score
-                for le in filter(lambda x: x.score == best_score, group):
-                    yield(le)
-            group = [last_entry]
-            prev_query = query_name
-        else:
-            group.append(last_entry)
-
-    if len(group) > 0:
-        if len(group) > 1:
-            multi_count += 1
-        group.sort(key=lambda x: x.subject_alignment_proportion, reverse=True)
-        group.sort(key=lambda x: x.query_alignment_proportion, reverse=True)
-        group.sort(key=lambda x: x.score)
-        best_score = group[0].score
-        for le in filter(lambda x: x.score == best_score, group):
-            yield(le)
+        blocks, alignment_length = alignment_blocks(subject_start, subject_align_string, query_align_string)
+        if compact:
+            yield(CompactLastEntry(names, score, names.intern(subject), subject_start, subject_length, names.intern(query), query_start, query_strand, query_length, alignment_length / float(query_length), alignment_length / float(subject_length), alignment_length, blocks))
+            continue
+        eg2 = float(sp_lines[0][2].split('=')[1])
+        e = float(sp_lines[0][3].split('=')[1])
+        subject_align_length = int(sp_lines[1][3])
+        subject_strand = sp_lines[1][4]
+        query_align_length = int(sp_lines[2][3])
+        yield(LastEntry(score, eg2, e, subject, subject_start, subject_align_length, subject_strand, subject_length, subject_align_string, query, query_start, query_align_length, query_strand, query_length, query_align_string, alignment_length / float(query_length), alignment_length / float(subject_length), alignment_length, blocks))
+
+
+def best_last_entries(f, compact=False, cache=False):
+    if isinstance(f, str):
+        alignment_cache = alignment_cache_for(f, compact, cache)
+        if alignment_cache is not None:
+            yield from alignment_cache.best_entries()
+            return
+        with open_alignment(f) as alignment_f:
+            yield from best_last_entries(alignment_f, compact=compact)
+        return
+    query = attrgetter('query_id') if compact else attrgetter('query')
+    rank = attrgetter('query_alignment_proportion', 'subject_alignment_proportion')
+    yield from best_hits.best_hits(last_entries(f, compact=compact), query, attrgetter('score'), rank=rank)
+
+
+# A parsed alignment file can be stored as an array cache of NumPy columns
+# next to it (<alignment>.cache, see array_cache.py), one row per MAF block in
+# file order.  Gapless blocks are held as flat start/length arrays indexed by
+# block_offsets, and best_order lists the rows best_last_entries would
+# yield, in order.
+ALIGNMENT_CACHE_ARRAYS = list(ALIGNMENT_CACHE_COLUMNS) + ['block_offsets', 'block_starts', 'block_lengths', 'best_order']
+
+
+def alignment_cache_path(fn):
+    return '{}.cache'.format(fn)
+
+
+@attr.s
+class AlignmentCache(object):
+    names = attr.ib()
+    columns = attr.ib()
+
+    def entries(self, rows):
+        columns = self.columns
+        block_offsets = columns['block_offsets']
+        starts = block_offsets[rows].tolist()
+        ends = block_offsets[rows + 1].tolist()
+        values = [columns[name][rows].tolist() for name in ALIGNMENT_CACHE_COLUMNS]
+        strand_index = list(ALIGNMENT_CACHE_COLUMNS).index('query_strand')
+        values[strand_index] = [chr(strand) for strand in values[strand_index]]
+        for row_values, start, end in zip(zip(*values), starts, ends):
+            blocks = tuple(zip(columns['block_starts'][start:end].tolist(), columns['block_lengths'][start:end].tolist()))
+            yield(CompactLastEntry(self.names, *row_values, blocks))
+
+    def last_entries(self):
+        return self.entries(numpy.arange(len(self.columns['score'])))
+
+    def best_entries(self):
+        return self.entries(numpy.asarray(self.columns['best_order']))
+
+
+def best_entry_order(columns):
+    score = columns['score']
+    if len(score) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    query_id = columns['query_id']
+    group = numpy.concatenate(([0], numpy.cumsum(query_id[1:] != query_id[:-1])))
+    group_starts = numpy.flatnonzero(numpy.concatenate(([True], query_id[1:] != query_id[:-1])))
+    best_score = numpy.maximum.reduceat(score, group_starts)[group]
+    order = numpy.lexsort((-columns['subject_alignment_proportion'], -columns['query_alignment_proportion'], -score, group))
+    return order[score[order] == best_score[order]]
+
+
+def build_alignment_cache(fn):
+    key = array_cache.source_key(fn, ALIGNMENT_CACHE_VERSION)
+    values = {name: [] for name in ALIGNMENT_CACHE_COLUMNS}
+    block_offsets = array.array('q', [0])
+    block_starts = array.array('q')
+    block_lengths = array.array('q')
+    names = None
+    with open_alignment(fn) as f:
+        for last_entry in last_entries(f, compact=True):
+            names = last_entry.names
+            for name, column in values.items():
+                column.append(getattr(last_entry, name))
+            for offset, length in last_entry.blocks:
+                block_starts.append(offset)
+                block_lengths.append(length)
+            block_offsets.append(len(block_starts))
+    values['query_strand'] = [ord(strand) for strand in values['query_strand']]
+    columns = {name: numpy.array(values[name], dtype=dtype) for name, dtype in ALIGNMENT_CACHE_COLUMNS.items()}
+    columns['block_offsets'] = numpy.frombuffer(block_offsets, dtype=numpy.int64)
+    columns['block_starts'] = numpy.frombuffer(block_starts, dtype=numpy.int64)
+    columns['block_lengths'] = numpy.frombuffer(block_lengths, dtype=numpy.int64)
+    columns['best_order'] = best_entry_order(columns)
+    names = names.names if names is not None else []
+    array_cache.write_array_cache(alignment_cache_path(fn), key, columns, {'names': names})
+    return load_alignment_cache(fn)
+
+
+def load_alignment_cache(fn):
+    cache = array_cache.load_array_cache(alignment_cache_path(fn), array_cache.source_key(fn, ALIGNMENT_CACHE_VERSION), ALIGNMENT_CACHE_ARRAYS, ['names'])
+    if cache is None:
+        return None
+    columns, name_lists = cache
+    names = name_lists['names']
+    return AlignmentCache(NameTable(dict(zip(names, range(len(names)))), names), columns)
+
+
+# Compact parses use a fresh cache whenever one exists; with cache=True a
+# missing or stale cache is rebuilt first.
+def alignment_cache_for(fn, compact, cache):
+    if not compact or not os.path.isfile(fn):
+        return None
+    alignment_cache = load_alignment_cache(fn)
+    if alignment_cache is None and cache:
+        alignment_cache = build_alignment_cache(fn)
+    return alignment_cache
 
 
 def add_last_coverage(subject_coverage, last_entry):
-    idx = last_entry.subject_start
-    for qbase, sbase in zip(last_entry.query_align_string, last_entry.subject_align_string):
-        if qbase == '-':
-            idx += 1
-        elif sbase == '-':
+    for offset, length in last_entry.blocks:
+        subject_coverage[offset:offset + length] += 1
+
+
+# Coverage is accumulated as a difference array, +1 at the start and -1 one
+# past the end of each block, and integrated with a cumulative sum once all
+# alignments for the subject have been added.
+def add_last_coverage_deltas(subject_deltas, last_entry):
+    for offset, length in last_entry.blocks:
+        subject_deltas[offset] += 1
+        subject_deltas[offset + length] -= 1
+
+
+def coverage_deltas(subject_length):
+    return numpy.zeros(subject_length + 1, dtype=numpy.int32)
+
+
+def integrate_coverage(subject_deltas):
+    return numpy.cumsum(subject_deltas[:-1], dtype=numpy.int32)
+
+
+def last_coverage(subject_length, last_entries):
+    subject_deltas = coverage_deltas(subject_length)
+    for last_entry in last_entries:
+        add_last_coverage_deltas(subject_deltas, last_entry)
+    return integrate_coverage(subject_deltas)
+
+
+# Inclusive (start, end) pairs of the runs of True in a boolean array.
+def true_runs(mask):
+    edges = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1) - 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def analyse_best_entries(best_entries, complete_scaffold_threshold, complete_transcript_threshold):
+    covered_transcript_alignments = defaultdict(list)
+    transcript_coverage = {}
+    complete_transcript_alignments = defaultdict(list)
+    query_counts = defaultdict(int)
+    for last_entry in best_entries:
+        if last_entry.query_alignment_proportion >= complete_scaffold_threshold and last_entry.subject_alignment_proportion >= complete_transcript_threshold:
+            complete_transcript_alignments[last_entry.subject].append(last_entry)
+            query_counts[last_entry.query] += 1
+        covered_transcript_alignments[last_entry.subject].append(last_entry)
+        if last_entry.subject not in transcript_coverage:
+            transcript_coverage[last_entry.subject] = coverage_deltas(last_entry.subject_length)
+
+        add_last_coverage_deltas(transcript_coverage[last_entry.subject], last_entry)
+    for subject, subject_deltas in transcript_coverage.items():
+        transcript_coverage[subject] = integrate_coverage(subject_deltas)
+    return (covered_transcript_alignments, complete_transcript_alignments, transcript_coverage, query_counts)
+
+
+# Parallel parsing relies on all blocks for a query being adjacent, as
+# best_last_entries does.  Each partition boundary is moved forward from an
+# evenly spaced byte offset to the first block whose query differs from the
+# query of the block following that offset.
+def next_query_start(f, offset):
+    f.seek(offset)
+    if offset > 0:
+        f.readline()
+    first_query = None
+    while True:
+        line_start = f.tell()
+        line = f.readline()
+        if not line:
+            return line_start
+        if line[0] != ord('a'):
             continue
-        else:
-            subject_coverage[idx] += 1
-            idx += 1
+        f.readline()
+        query = f.readline().split()[1]
+        if first_query is None:
+            first_query = query
+        elif query != first_query:
+            return line_start
+
+
+def query_partitions(fn, partition_count):
+    size = os.path.getsize(fn)
+    boundaries = [0]
+    with open(fn, 'rb') as f:
+        for i in range(1, partition_count):
+            offset = max(size * i // partition_count, boundaries[-1])
+            boundaries.append(next_query_start(f, offset))
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def byte_range_lines(fn, start, end):
+    with open(fn, 'rb') as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode('ascii')
+
 
+def analyse_alignment_range(fn, start, end, complete_scaffold_threshold, complete_transcript_threshold, compact):
+    best_entries = best_last_entries(byte_range_lines(fn, start, end), compact=compact)
+    return analyse_best_entries(best_entries, complete_scaffold_threshold, complete_transcript_threshold)
 
-def analyse_transcript_alignment(fn, complete_scaffold_threshold=0.95, complete_transcript_threshold=0.95):
+
+def merge_alignment_analyses(analyses):
     covered_transcript_alignments = defaultdict(list)
     transcript_coverage = {}
     complete_transcript_alignments = defaultdict(list)
     query_counts = defaultdict(int)
-    with open(fn) as f:
-        for last_entry in best_last_entries(f):
-            if last_entry.query_alignment_proportion >= complete_scaffold_threshold and last_entry.subject_alignment_proportion >= complete_transcript_threshold:
-                complete_transcript_alignments[last_entry.subject].append(last_entry)
-                query_counts[last_entry.query] += 1
-            covered_transcript_alignments[last_entry.subject].append(last_entry)
-            if last_entry.subject not in transcript_coverage:
-                transcript_coverage[last_entry.subject] = array.array('i', [0]) * last_entry.subject_length
-
-            add_last_coverage(transcript_coverage[last_entry.subject], last_entry)
+    for covered, complete, coverage, counts in analyses:
+        for subject, alignments in covered.items():
+            covered_transcript_alignments[subject].extend(alignments)
+        for subject, alignments in complete.items():
+            complete_transcript_alignments[subject].extend(alignments)
+        for subject, subject_coverage in coverage.items():
+            if subject in transcript_coverage:
+                transcript_coverage[subject] += subject_coverage
+            else:
+                transcript_coverage[subject] = subject_coverage
+        for query, count in counts.items():
+            query_counts[query] += count
     return (covered_transcript_alignments, complete_transcript_alignments, transcript_coverage, query_counts)
 
 
-def get_gaps(transcript_seq, covered_transcript_alignments):
-    scaffold_coverage = array.array('I', [0]) * len(transcript_seq)
-    for last_entry in covered_transcript_alignments:
-        add_last_coverage(scaffold_coverage, last_entry)
-
-    gaps = []
-    cur_region = None
-    for idx, (sc1, base) in enumerate(zip(scaffold_coverage, transcript_seq)):
-        if sc1 > 0:
-            if cur_region is not None:
-                gaps.append(transcript_seq[cur_region[0]:cur_region[1] + 1])
-            cur_region = None
-        elif cur_region is None:
-            cur_region = [idx, idx]
-        else:
-            cur_region[1] = idx
-    if cur_region is not None:
-        gaps.append(transcript_seq[cur_region[0]:cur_region[1] + 1])
-    return gaps
-
-
-def get_covered(transcript_seq, covered_transcript_alignments):
-    scaffold_coverage = array.array('I', [0]) * len(transcript_seq)
-    for last_entry in covered_transcript_alignments:
-        add_last_coverage(scaffold_coverage, last_entry)
-
-    covered = []
-    cur_region = None
-    for idx, (sc1, base) in enumerate(zip(scaffold_coverage, transcript_seq)):
-        if sc1 == 0:
-            if cur_region is not None:
-                covered.append(transcript_seq[cur_region[0]:cur_region[1] + 1])
-            cur_region = None
-        elif cur_region is None:
-            cur_region = [idx, idx]
-        else:
-            cur_region[1] = idx
-    if cur_region is not None:
-        covered.append(transcript_seq[cur_region[0]:cur_region[1] + 1])
-    return covered
+# The best rows of a cache are grouped by query, so they are split into
+# partitions of about the same number of rows at the query changes
+def best_row_partitions(alignment_cache, partition_count):
+    best_order = numpy.asarray(alignment_cache.columns['best_order'])
+    query_id = numpy.asarray(alignment_cache.columns['query_id'])[best_order]
+    query_starts = numpy.append(numpy.flatnonzero(query_id[1:] != query_id[:-1]) + 1, len(best_order))
+    boundaries = numpy.unique(numpy.concatenate(([0], query_starts[numpy.searchsorted(query_starts, numpy.arange(1, partition_count + 1) * len(best_order) // partition_count)]))).tolist()
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def analyse_cached_rows(fn, start, end, complete_scaffold_threshold, complete_transcript_threshold):
+    alignment_cache = load_alignment_cache(fn)
+    rows = numpy.asarray(alignment_cache.columns['best_order'][start:end])
+    return analyse_best_entries(alignment_cache.entries(rows), complete_scaffold_threshold, complete_transcript_threshold)
+
+
+def analyse_transcript_alignment(fn, complete_scaffold_threshold=0.95, complete_transcript_threshold=0.95, compact=False, processes=1, cache=False):
+    alignment_cache = alignment_cache_for(fn, compact, cache)
+    if alignment_cache is not None:
+        if processes > 1:
+            partitions = best_row_partitions(alignment_cache, processes)
+            with multiprocessing.Pool(processes) as pool:
+                analyses = pool.starmap(analyse_cached_rows, ((fn, start, end, complete_scaffold_threshold, complete_transcript_threshold) for start, end in partitions))
+            return merge_alignment_analyses(analyses)
+        return analyse_best_entries(alignment_cache.best_entries(), complete_scaffold_threshold, complete_transcript_threshold)
+    # Compressed alignments cannot be split, so without a cache they are
+    # always parsed serially
+    if processes > 1 and not is_compressed(fn) and os.path.isfile(fn):
+        partitions = query_partitions(fn, processes)
+        with multiprocessing.Pool(processes) as pool:
+            analyses = pool.starmap(analyse_alignment_range, ((fn, start, end, complete_scaffold_threshold, complete_transcript_threshold, compact) for start, end in partitions))
+        return merge_alignment_analyses(analyses)
+    with open_alignment(fn) as f:
+        return analyse_best_entries(best_last_entries(f, compact=compact), complete_scaffold_threshold, complete_transcript_threshold)
+
 
+# Inclusive (start, end) coordinates of the regions of a transcript that no
+# scaffold covers, or that some scaffold covers
+def get_gaps(transcript_length, covered_transcript_alignments):
+    scaffold_coverage = last_coverage(transcript_length, covered_transcript_alignments)
+    return true_runs(scaffold_coverage == 0)
 
+
+def get_covered(transcript_length, covered_transcript_alignments):
+    scaffold_coverage = last_coverage(transcript_length, covered_transcript_alignments)
+    return true_runs(scaffold_coverage > 0)
+
+
+# Views of the per-base read depths of the wanted transcripts
 def get_read_coverage(fn, wanted_transcripts):
-    read_coverage = {}
-    with open(fn) as f:
-        for line in f:
-            sp_line = line.rstrip(os.linesep).split("\t")
-            transcript = sp_line[0]
-            if transcript not in wanted_transcripts:
-                continue
-            read_coverage[transcript] = array.array('I')
-            for idx, depth in enumerate((int(depth) for depth in sp_line[1:])):
-                read_coverage[transcript].append(depth)
-    return read_coverage
-
-
-def seq_gc_content(seq):
-    seq = seq.upper()
-    gc_count = 0
-    for base in seq:
-        if base == 'G' or base == 'C':
-            gc_count += 1
-    return gc_count / float(len(seq))
-
-
-def kmer_gc_frequencies(seq, kmer_size, min_size):
-    seq = seq.upper()
-    if kmer_size > len(seq) and len(seq) < min_size:
-        return []
-    current_count = Counter(seq[0:kmer_size])
-    gc_freqs = [(current_count['G'] + current_count['C']) / float(sum(current_count.values()))]
-    if kmer_size > len(seq):
-        return gc_freqs
-
-    for i in range(kmer_size, len(seq)):
-        current_count[seq[i - kmer_size]] -= 1
-        current_count[seq[i]] += 1
-        gc_freqs.append((current_count['G'] + current_count['C']) / float(sum(current_count.values())))
-    return gc_freqs
-
-
-def get_transcript_read_coverage(fn, missing_complete_transcripts):
+    return depth_matrix.depth_matrix_for(fn, wanted_transcripts).select(wanted_transcripts)
+
+
+def get_transcript_read_coverage(fn, missing_complete_transcripts, compact=False, cache=False):
     transcript_read_coverage = {}
-    with open(fn) as f:
-        for last_entry in best_last_entries(f):
-            if last_entry.subject not in missing_complete_transcripts:
-                continue
-            elif last_entry.subject not in transcript_read_coverage:
-                transcript_read_coverage[last_entry.subject] = array.array('I', [0]) * last_entry.subject_length
-
-            add_last_coverage(transcript_read_coverage[last_entry.subject], last_entry)
+    for last_entry in best_last_entries(fn, compact=compact, cache=cache):
+        if last_entry.subject not in missing_complete_transcripts:
+            continue
+        elif last_entry.subject not in transcript_read_coverage:
+            transcript_read_coverage[last_entry.subject] = coverage_deltas(last_entry.subject_length)
+
+        add_last_coverage_deltas(transcript_read_coverage[last_entry.subject], last_entry)
+    for subject, subject_deltas in transcript_read_coverage.items():
+        transcript_read_coverage[subject] = integrate_coverage(subject_deltas)
     return transcript_read_coverage
 
 
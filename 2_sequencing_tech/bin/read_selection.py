@@ -0,0 +1,135 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import numpy
+import fastq
+import fastq_index
+import subset_output
+
+# Hash-based read selection.  Each read-pair gets a seeded 64-bit hash of its
+# name, and a subset is the read-pairs with the smallest hashes up to the
+# wanted number of bases.  Membership depends only on the names and lengths
+# of the reads, not on the order they are read in, so parts of a dataset can
+# be subset in parallel and the results concatenated, and subsets of
+# different sizes drawn with the same seed are nested.
+#
+# A first pass sums the bases of the read-pairs in each of HASH_BUCKETS
+# ranges of hash values.  The buckets below the one where the cumulative sum
+# reaches the wanted size are taken whole in a second pass, which also
+# returns the read-pairs of that boundary bucket; those are then taken in
+# hash order until the wanted size is reached, so a subset exceeds its size
+# by less than one read-pair, as with sequential selection.
+
+HASH_BUCKET_BITS = 20
+HASH_BUCKETS = 1 << HASH_BUCKET_BITS
+HASH_CHUNK_SIZE = 1000000
+
+
+def read_hash(name, seed=0):
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8, key=str(seed).encode()).digest(), 'big')
+
+
+def hash_bucket(read_hash):
+    return read_hash >> (64 - HASH_BUCKET_BITS)
+
+
+def bucket_bases(task):
+    fn1, fn2, start, end, seed = task
+    bases = numpy.zeros(HASH_BUCKETS, dtype=numpy.int64)
+    buckets = []
+    pair_bases = []
+    for pair in fastq.read_pairs(fn1, fn2, start, end):
+        buckets.append(hash_bucket(read_hash(pair[0], seed)))
+        pair_bases.append(fastq.pair_bases(pair))
+        if len(buckets) == HASH_CHUNK_SIZE:
+            bases += numpy.bincount(buckets, weights=pair_bases, minlength=HASH_BUCKETS).astype(numpy.int64)
+            buckets = []
+            pair_bases = []
+    if len(buckets) > 0:
+        bases += numpy.bincount(buckets, weights=pair_bases, minlength=HASH_BUCKETS).astype(numpy.int64)
+    return bases
+
+
+# The boundary bucket of each size, and the bases still wanted from it after
+# the buckets below it are taken
+def boundary_buckets(bases, sizes):
+    cumulative = numpy.cumsum(bases)
+    boundaries = numpy.searchsorted(cumulative, sizes, side='right')
+    taken = numpy.where(boundaries > 0, cumulative[numpy.maximum(boundaries - 1, 0)], 0)
+    return boundaries.tolist(), (numpy.asarray(sizes) - taken).tolist()
+
+
+# Writes the read-pairs of one part below each boundary to part files of the
+# outputs, returning the hashed read-pairs in each boundary bucket
+def select_part(task):
+    part, (fn1, fn2, start, end), seed, boundaries, outputs = task
+    writers = [subset_output.SubsetWriter(output.part(part)) for output in outputs]
+    boundary_pairs = [[] for boundary in boundaries]
+    for pair in fastq.read_pairs(fn1, fn2, start, end):
+        pair_hash = read_hash(pair[0], seed)
+        bucket = hash_bucket(pair_hash)
+        for i, boundary in enumerate(boundaries):
+            if bucket < boundary:
+                writers[i].write(pair)
+            elif bucket == boundary:
+                # Copied out of the read block, which it would otherwise keep
+                boundary_pairs[i].append((pair_hash, (pair[0], bytes(pair[1]), bytes(pair[2])) + pair[3:]))
+    for writer in writers:
+        writer.close(join_fasta=False)
+    return boundary_pairs
+
+
+# Concatenates the part files of each file of an output
+def concatenate_parts(output, part_count):
+    part_paths = zip(*(output.part(part).paths() for part in range(part_count)))
+    for fn, fn_parts in zip(output.paths(), part_paths):
+        with open(fn, 'wb') as out_h:
+            for part_fn in fn_parts:
+                with open(part_fn, 'rb') as part_h:
+                    shutil.copyfileobj(part_h, out_h)
+                os.remove(part_fn)
+
+
+# Parts of the (fn1, fn2) FastQ file pairs to read in parallel, as (fn1, fn2,
+# start, end) with start and end offsets for fastq.read_pairs.  With fewer
+# pairs than processes, pairs are split at checkpoints of their indexes.
+def fastq_parts(fastq_pairs, processes):
+    if len(fastq_pairs) >= processes:
+        return [(fn1, fn2, (0, 0), (None, None)) for fn1, fn2 in fastq_pairs]
+    part_count = -(-processes // len(fastq_pairs))
+    return [(fn1, fn2, start, end) for fn1, fn2 in fastq_pairs for start, end in fastq_index.pair_ranges(fn1, fn2, part_count)]
+
+
+# Writes a subset of about each size of the read-pairs of the (fn1, fn2)
+# FastQ file pairs to the matching subset_output.SubsetOutput outputs,
+# returning the bases of each subset
+def hash_subsets(fastq_pairs, sizes, outputs, seed=0, processes=1):
+    parts = fastq_parts(fastq_pairs, processes)
+    with multiprocessing.Pool(processes) as pool:
+        bases = sum(pool.imap(bucket_bases, ((fn1, fn2, start, end, seed) for fn1, fn2, start, end in parts)))
+        boundaries, wanted = boundary_buckets(bases, sizes)
+        tasks = ((i, part, seed, boundaries, outputs) for i, part in enumerate(parts))
+        boundary_pairs = [[] for size in sizes]
+        for part_boundary_pairs in pool.imap(select_part, tasks):
+            for i, pairs in enumerate(part_boundary_pairs):
+                boundary_pairs[i].extend(pairs)
+
+    subset_bases = []
+    for i, output in enumerate(outputs):
+        concatenate_parts(output, len(parts))
+        # Take read-pairs of the boundary bucket in hash order while bases
+        # are still wanted
+        writer = subset_output.SubsetWriter(output, append=True)
+        for pair_hash, pair in sorted(boundary_pairs[i], key=lambda hashed_pair: (hashed_pair[0], hashed_pair[1][0])):
+            if wanted[i] <= 0:
+                break
+            writer.write(pair)
+            wanted[i] -= fastq.pair_bases(pair)
+        writer.close()
+        # The FastQ files were assembled from parts, so are indexed afresh
+        if output.index:
+            fastq_index.build_fastq_index(output.fq1)
+            fastq_index.build_fastq_index(output.fq2)
+        subset_bases.append(sizes[i] - wanted[i])
+    return subset_bases
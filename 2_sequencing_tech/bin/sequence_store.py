@@ -0,0 +1,170 @@
+import attr
+import numpy
+import array_cache
+import fasta_index
+
+SEQUENCE_STORE_VERSION = 1
+SEQUENCE_STORE_ARRAYS = ['lengths', 'offsets', 'packed', 'gc_blocks', 'n_starts', 'n_ends', 'mask_starts', 'mask_ends']
+GC_BLOCK_BASES = 256
+GC_BLOCK_BYTES = GC_BLOCK_BASES // 4
+PACK_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Bases are packed four to a byte as A=0, C=1, G=2, T=3, lowest bits first.
+# Any other base is stored as A and recorded as a run of Ns, and lower case
+# bases as runs of soft-masking.
+BASE_CODES = numpy.zeros(256, dtype=numpy.uint8)
+IS_BASE = numpy.zeros(256, dtype=bool)
+for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for base in bases:
+        BASE_CODES[ord(base)] = code
+        IS_BASE[ord(base)] = True
+IS_LOWER = numpy.zeros(256, dtype=bool)
+IS_LOWER[ord('a'):ord('z') + 1] = True
+CODE_BASES = numpy.frombuffer(b'ACGT', dtype=numpy.uint8)
+GC_CODES = numpy.array([False, True, True, False])
+
+# C (01) and G (10) are the codes whose two bits differ, so the G/C bases of
+# a packed byte are the population count of (byte ^ byte >> 1) & 0x55
+BYTE_GC = numpy.array([bin((byte ^ byte >> 1) & 0x55).count('1') for byte in range(256)], dtype=numpy.int64)
+
+
+# Half-open [start, end) runs of True
+def mask_runs(mask):
+    edges = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+
+# A sequence store holds sequences 2-bit packed.  Sequence i starts at base
+# offsets[i] of packed (a multiple of 4), and gc_blocks[j] counts the G/C
+# bases before base j * GC_BLOCK_BASES, so the G/C count of any range takes
+# one table lookup and at most one block of packed bytes.  N and soft-masked
+# runs are kept as sorted [start, end) intervals in the same coordinates.
+@attr.s
+class SequenceStore(object):
+    names = attr.ib()
+    lengths = attr.ib()
+    offsets = attr.ib()
+    packed = attr.ib()
+    gc_blocks = attr.ib()
+    n_starts = attr.ib()
+    n_ends = attr.ib()
+    mask_starts = attr.ib()
+    mask_ends = attr.ib()
+    ids = attr.ib()
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def length(self, name):
+        return int(self.lengths[self.ids[name]])
+
+    def bounds(self, name, start, end):
+        sequence_id = self.ids[name]
+        end = int(self.lengths[sequence_id]) if end is None else min(end, int(self.lengths[sequence_id]))
+        return int(self.offsets[sequence_id]), start, max(end, start)
+
+    # 2-bit codes of bases [start, end) of a sequence
+    def codes(self, name, start=0, end=None):
+        offset, start, end = self.bounds(name, start, end)
+        first = offset + start
+        data = numpy.asarray(self.packed[first // 4:(offset + end + 3) // 4])
+        codes = (data[:, numpy.newaxis] >> numpy.array([0, 2, 4, 6], dtype=numpy.uint8)) & 3
+        return codes.ravel()[first % 4:first % 4 + end - start]
+
+    # G/C bases before each base offset of the store
+    def gc_before(self, positions):
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        blocks = positions // GC_BLOCK_BASES
+        byte_ends = positions // 4
+        byte_index = blocks[:, numpy.newaxis] * GC_BLOCK_BYTES + numpy.arange(GC_BLOCK_BYTES)
+        whole_bytes = byte_index < byte_ends[:, numpy.newaxis]
+        counts = numpy.asarray(self.gc_blocks)[blocks] + (BYTE_GC[numpy.asarray(self.packed)[numpy.minimum(byte_index, len(self.packed) - 1)]] * whole_bytes).sum(axis=1)
+        # The first bases of a partly counted byte
+        partial_bytes = numpy.asarray(self.packed)[numpy.minimum(byte_ends, len(self.packed) - 1)]
+        return counts + BYTE_GC[partial_bytes & ((1 << 2 * (positions % 4)) - 1).astype(numpy.uint8)]
+
+    # G/C bases in each range [starts[i], ends[i]) of a sequence
+    def gc_counts(self, name, starts, ends):
+        offset = int(self.offsets[self.ids[name]])
+        return self.gc_before(offset + numpy.asarray(ends, dtype=numpy.int64)) - self.gc_before(offset + numpy.asarray(starts, dtype=numpy.int64))
+
+    # G/C bases before each position of [start, end] of a sequence, as
+    # gc_content.gc_sums gives for the substring
+    def gc_sums(self, name, start=0, end=None):
+        return numpy.concatenate(([0], numpy.cumsum(GC_CODES[self.codes(name, start, end)], dtype=numpy.int64)))
+
+    def sequence(self, name, start=0, end=None):
+        offset, start, end = self.bounds(name, start, end)
+        bases = CODE_BASES[self.codes(name, start, end)]
+        for run_starts, run_ends, apply in [(self.n_starts, self.n_ends, lambda run: ord('N')), (self.mask_starts, self.mask_ends, lambda run: run | 0x20)]:
+            first = int(numpy.searchsorted(run_ends, offset + start, side='right'))
+            last = int(numpy.searchsorted(run_starts, offset + end, side='left'))
+            for run_start, run_end in zip(numpy.asarray(run_starts[first:last]).tolist(), numpy.asarray(run_ends[first:last]).tolist()):
+                run = slice(max(run_start - offset, start) - start, min(run_end - offset, end) - start)
+                bases[run] = apply(bases[run])
+        return bases.tobytes().decode()
+
+
+def sequence_store(names, arrays):
+    return SequenceStore(names, ids={name: i for i, name in enumerate(names)}, **arrays)
+
+
+# Packs the named sequences of a FASTA file, or all of them, reading them
+# through its faidx index
+def compile_sequence_store(fn, names=None):
+    fasta = fasta_index.open_indexed_fasta(fn)
+    names = list(fasta.entries) if names is None else [name for name in fasta.entries if name in names]
+    lengths = numpy.array([fasta.length(name) for name in names], dtype=numpy.int64)
+    offsets = numpy.concatenate(([0], numpy.cumsum((lengths + 3) // 4 * 4)))
+    packed = numpy.zeros(-(-int(offsets[-1]) // GC_BLOCK_BASES) * GC_BLOCK_BYTES, dtype=numpy.uint8)
+    runs = {'n_starts': [], 'n_ends': [], 'mask_starts': [], 'mask_ends': []}
+    for name, offset in zip(names, offsets.tolist()):
+        bases = numpy.frombuffer(fasta.fetch_bytes(name), dtype=numpy.uint8)
+        codes = numpy.zeros(-(-len(bases) // 4) * 4, dtype=numpy.uint8)
+        codes[:len(bases)] = BASE_CODES[bases]
+        packed[offset // 4:offset // 4 + len(codes) // 4] = codes[0::4] | codes[1::4] << 2 | codes[2::4] << 4 | codes[3::4] << 6
+        for kind, mask in [('n', ~IS_BASE[bases]), ('mask', IS_LOWER[bases])]:
+            run_starts, run_ends = mask_runs(mask)
+            runs['{}_starts'.format(kind)].append(run_starts + offset)
+            runs['{}_ends'.format(kind)].append(run_ends + offset)
+
+    block_gc = [BYTE_GC[packed[start:start + PACK_CHUNK_BYTES]].reshape(-1, GC_BLOCK_BYTES).sum(axis=1) for start in range(0, len(packed), PACK_CHUNK_BYTES)]
+    arrays = {
+        'lengths': lengths,
+        'offsets': offsets[:-1],
+        'packed': packed,
+        'gc_blocks': numpy.concatenate(([0], numpy.cumsum(numpy.concatenate(block_gc) if block_gc else numpy.zeros(0, dtype=numpy.int64)))),
+    }
+    for name, values in runs.items():
+        arrays[name] = numpy.concatenate(values).astype(numpy.int64) if values else numpy.zeros(0, dtype=numpy.int64)
+    return sequence_store(names, arrays)
+
+
+# A packed store is kept as an array cache next to the FASTA file
+# (<fasta>.2bit, see array_cache.py).
+def sequence_store_path(fn):
+    return '{}.2bit'.format(fn)
+
+
+def build_sequence_store(fn):
+    key = array_cache.source_key(fn, SEQUENCE_STORE_VERSION)
+    store = compile_sequence_store(fn)
+    array_cache.write_array_cache(sequence_store_path(fn), key, {name: getattr(store, name) for name in SEQUENCE_STORE_ARRAYS}, {'names': store.names})
+    return load_sequence_store(fn)
+
+
+def load_sequence_store(fn):
+    cache = array_cache.load_array_cache(sequence_store_path(fn), array_cache.source_key(fn, SEQUENCE_STORE_VERSION), SEQUENCE_STORE_ARRAYS, ['names'])
+    if cache is None:
+        return None
+    arrays, name_lists = cache
+    return sequence_store(name_lists['names'], arrays)
+
+
+# Use a fresh packed store when there is one, otherwise pack just the wanted
+# sequences
+def sequence_store_for(fn, names=None):
+    store = load_sequence_store(fn)
+    if store is None:
+        store = compile_sequence_store(fn, names)
+    return store
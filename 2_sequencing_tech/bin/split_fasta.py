@@ -1,33 +1,79 @@
 #!/usr/bin/env python3
 
 import argparse
+import heapq
+import math
+import os
 from Bio.SeqIO.FastaIO import SimpleFastaParser
 
 
+# Extra cost of a record in bases, from a model fit by fit_blat_cost.py of
+# blat runtime against the records and bases of each part
+def read_record_cost(fn):
+    with open(fn) as model_h:
+        header = model_h.readline().rstrip(os.linesep).split('\t')
+        model = dict(zip(header, (float(value) for value in model_h.readline().rstrip(os.linesep).split('\t'))))
+    if model['per_base'] <= 0:
+        return 0
+    return max(model['per_record'] / model['per_base'], 0)
+
+
+# Longest processing time first: records are placed in descending order of
+# cost, each on the part with the least cost so far
+def assign_parts(costs, part_count):
+    parts = [(0, part) for part in range(part_count)]
+    assignments = [0] * len(costs)
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        part_cost, part = heapq.heappop(parts)
+        assignments[i] = part
+        heapq.heappush(parts, (part_cost + costs[i], part))
+    return assignments
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument('fasta_in')
     ap.add_argument('splits', type=int)
     ap.add_argument('fasta_out_prefix')
+    ap.add_argument('-t', '--target-cost', type=int, help='Use as many parts, up to splits, as give each about this cost in bases')
+    ap.add_argument('-c', '--cost-model', help='Weight records by a blat runtime model from fit_blat_cost.py')
     args = ap.parse_args()
 
-    digits = len(str(args.splits))
+    with open(args.fasta_in) as fasta_h:
+        lengths = [len(seq) for title, seq in SimpleFastaParser(fasta_h)]
+    record_cost = read_record_cost(args.cost_model) if args.cost_model is not None else 0
+    costs = [length + record_cost for length in lengths]
+
+    splits = args.splits
+    if args.target_cost is not None:
+        splits = max(1, min(splits, len(costs), math.ceil(sum(costs) / args.target_cost)))
+    assignments = assign_parts(costs, splits)
+
+    digits = len(str(splits))
     output_files = []
-    output_lengths = [0] * args.splits
-    for i in range(0, args.splits):
+    for i in range(0, splits):
         padded_num = str(i).zfill(digits)
         output_files.append(open('{0}_part_{1}.fa'.format(args.fasta_out_prefix, padded_num), 'w'))
 
+    # Records are written in input order, so the input is read sequentially
     with open(args.fasta_in) as fasta_h:
-        for title, seq in SimpleFastaParser(fasta_h):
-            min_length = min(output_lengths)
-            min_idx = output_lengths.index(min_length)
-            output_files[min_idx].write(">{}\n{}\n".format(title, seq))
-            output_lengths[min_idx] += len(seq)
+        for part, (title, seq) in zip(assignments, SimpleFastaParser(fasta_h)):
+            output_files[part].write(">{}\n{}\n".format(title, seq))
 
     for f in output_files:
         f.close()
 
+    # The records and bases of each part, for fitting a cost model to blat
+    # runtimes
+    part_records = [0] * splits
+    part_bases = [0] * splits
+    for part, length in zip(assignments, lengths):
+        part_records[part] += 1
+        part_bases[part] += length
+    with open('{}_parts.txt'.format(args.fasta_out_prefix), 'w') as parts_h:
+        for i in range(0, splits):
+            parts_h.write('{}\t{}\t{}\n'.format(str(i).zfill(digits), part_records[i], part_bases[i]))
+
 
 if __name__ == '__main__':
     main()
@@ -1,61 +1,94 @@
-#!/usr/bin/python2
+#!/usr/bin/env python3
 
-import sys
+import argparse
 import random
+import fastq
+import fastq_index
+import read_selection
+import subset_output
+
+# Usage: ./subset.py [-c <base-count-file>] -s <subset-size> <output-dir> [-s <subset-size> <output-dir> ...] fastq-files-1.fastq
+# ./subset.py -s 100000 tests/subset_100k -s 200000 tests/subset_200k tests/171p5-00?/171p5-00?-1.fastq
+#
+# All subset sizes are written in one pass over the reads, and each subset is
+# contained in every larger one.  The total number of bases is read from the
+# FastQ indexes (see fastq_index.py), which are built if missing, unless a
+# count file is given.  With --hash, read-pairs are instead chosen by a
+# seeded hash of their names (see read_selection.py), which does not need the
+# base count and spreads the FastQ files over processes.
+#
+# Besides 1.fq and 2.fq, each output directory can get reads.fa (--fasta),
+# reads.txt (--names) and FastQ indexes with the read and base totals of the
+# subset (--index), written in the same pass (see subset_output.py).
+
+
+def main():
+   ap = argparse.ArgumentParser()
+   ap.add_argument('-c', '--count', help='File holding the total number of bases of the FastQ files')
+   ap.add_argument('-s', '--subset', nargs=2, action='append', required=True, metavar=('SIZE', 'OUTPUT_DIR'))
+   ap.add_argument('--hash', action='store_true', help='Choose read-pairs by a hash of their names')
+   ap.add_argument('--seed', type=int, default=0)
+   ap.add_argument('-p', '--processes', type=int, default=1)
+   ap.add_argument('--fasta', action='store_true', help='Also write the subsets as FASTA to reads.fa')
+   ap.add_argument('--names', action='store_true', help='Also write the read names of the subsets to reads.txt')
+   ap.add_argument('--index', action='store_true', help='Also write FastQ indexes, with read and base totals, of the subsets')
+   ap.add_argument('fastq', nargs='+')
+   args = ap.parse_args()
 
-# Usage: ./subset.py <subset-size> output-basename fastq-files-1.fq 
-# ./subset.py 100000 tests/subset tests/171p5-00?/171p5-00?-1.fq
-
-
-# Iterator to fetch pair of sequences, one from each of two FastQ files.
-class readFastQ():
-   def __init__(self, filename1, filename2):
-      self.file1 = open(filename1, 'r') 
-      self.file2 = open(filename2, 'r') 
-   def __iter__(self):
-      return self
-   def next(self):
-      lines1 = [self.file1.next().rstrip() for x in range(4)]
-      lines2 = [self.file2.next().rstrip() for x in range(4)]
-      name = lines1[0][1:].rsplit('/', 1)[0]
-      name = name.rsplit(' ', 1)[0]
-      return (name, lines1[1], lines1[3], lines2[1], lines2[3])
-
-# read through all FastQ files and count bases
-base_total = 0
-for file1name in sys.argv[3:]:
-   # generate the second FastQ filename from the first
-   file2name = file1name.replace('1.fastq', '2.fastq')
-   print 'Now reading:', file1name, file2name
-   for cluster in readFastQ(file1name, file2name):
-      bases = len(cluster[1]) + len(cluster[3])
-      base_total += bases
-
-print "Total Bases:", base_total
-
-# now repeat-- choosing read-pairs for output
-random.seed(0)
-output1 = open('{}/1.fq'.format(sys.argv[2]), 'w')
-output2 = open('{}/2.fq'.format(sys.argv[2]), 'w')
-
-target = int(sys.argv[1])
-remaining = base_total
-for file1name in sys.argv[3:]:
    # generate the second FastQ filename from the first
-   file2name = file1name.replace('1.fastq', '2.fastq')
-   print 'Now reading:', file1name, file2name
-   for cluster in readFastQ(file1name, file2name):
-      bases = len(cluster[1]) + len(cluster[3])
-      # want to output target bases of the remaining bases
-      if random.random() < float(target) / remaining:
-         #print target, remaining
-         output1.write('@{}/1\n{}\n+\n{}\n'.format(cluster[0],
-                                       cluster[1], cluster[2]))
-         output2.write('@{}/2\n{}\n+\n{}\n'.format(cluster[0],
-                                       cluster[3], cluster[4]))
-         target -= bases
-      remaining -= bases
-output2.close()
-output1.close()
-
-print 'Final output size:', int(sys.argv[1]) - target
+   fastq_pairs = [(file1name, file1name.replace('1.fastq', '2.fastq')) for file1name in args.fastq]
+
+   if args.hash:
+      sizes = [int(size) for size, output_dir in args.subset]
+      outputs = [subset_output.subset_output_in(output_dir, args.fasta, args.names, args.index) for size, output_dir in args.subset]
+      subset_bases = read_selection.hash_subsets(fastq_pairs, sizes, outputs, args.seed, args.processes)
+      for (size, output_dir), bases in zip(args.subset, subset_bases):
+         print('Final output size:', output_dir, bases)
+      return
+
+   if args.count is not None:
+      with open(args.count) as count_h:
+         base_total = int(count_h.read().split()[0])
+   else:
+      base_total = sum(fastq_index.fastq_index_for(fn).bases for fastq_pair in fastq_pairs for fn in fastq_pair)
+   print("Total Bases:", base_total)
+
+   # Subsets from largest to smallest
+   subsets = sorted(((int(size), output_dir) for size, output_dir in args.subset), reverse=True)
+   writers = [subset_output.SubsetWriter(subset_output.subset_output_in(output_dir, args.fasta, args.names, args.index)) for size, output_dir in subsets]
+
+   # A read-pair goes into a subset when one uniform draw falls below the bases
+   # still wanted by that subset over the bases remaining, as when subsets are
+   # drawn one at a time.  The threshold of a subset is capped at those of the
+   # larger subsets so that the subsets stay nested.  The cap binds once a
+   # larger subset wants fewer of the remaining bases than a smaller one, after
+   # which the smaller subset takes fewer read-pairs than it would on its own
+   # and can end short of its size, so the shortfall of each size is reported.
+   random.seed(args.seed)
+   targets = [size for size, output_dir in subsets]
+   remaining = base_total
+   for file1name, file2name in fastq_pairs:
+      print('Now reading:', file1name, file2name)
+      for cluster in fastq.read_pairs(file1name, file2name):
+         bases = fastq.pair_bases(cluster)
+         draw = random.random()
+         threshold = float('inf')
+         for i in range(len(subsets)):
+            threshold = min(threshold, float(targets[i]) / remaining)
+            # want to output target bases of the remaining bases
+            if draw >= threshold:
+               break
+            writers[i].write(cluster)
+            targets[i] -= bases
+         remaining -= bases
+
+   for writer in writers:
+      writer.close()
+
+   for (size, output_dir), target in zip(subsets, targets):
+      print('Final output size:', output_dir, size - target)
+      print('Shortfall:', output_dir, max(target, 0))
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,122 @@
+import attr
+import os
+import shutil
+import fastq
+import fastq_index
+
+# The files of a subset, all written as its read-pairs are selected so the
+# subset FastQ files need not be read again: the two FastQ files, and
+# optionally
+#   fasta  all first mates then all second mates as FASTA, as from
+#          seqtk seq -A on each FastQ file in turn
+#   names  the read names, one per line, as for picard FilterSamReads
+#   index  FastQ indexes of the two FastQ files (see fastq_index.py), which
+#          hold their read and base totals
+# Second mates are written to a temporary FASTA file that is appended to the
+# first when the subset is closed.
+
+
+def part_path(fn, part):
+    return '{}.part{}'.format(fn, part)
+
+
+def mate2_fasta_path(fn):
+    return '{}.mate2'.format(fn)
+
+
+@attr.s
+class SubsetOutput(object):
+    fq1 = attr.ib()
+    fq2 = attr.ib()
+    fasta = attr.ib(default=None)
+    names = attr.ib(default=None)
+    index = attr.ib(default=False)
+
+    # The files written by SubsetWriter, second mate FASTA included
+    def paths(self):
+        paths = [self.fq1, self.fq2]
+        if self.fasta is not None:
+            paths.extend([self.fasta, mate2_fasta_path(self.fasta)])
+        if self.names is not None:
+            paths.append(self.names)
+        return paths
+
+    # The part files of one part of a subset selected in parallel
+    def part(self, part):
+        return SubsetOutput(part_path(self.fq1, part), part_path(self.fq2, part),
+                            None if self.fasta is None else part_path(self.fasta, part),
+                            None if self.names is None else part_path(self.names, part))
+
+
+# Output directories of subset.py hold 1.fq, 2.fq, reads.fa and reads.txt
+def subset_output_in(output_dir, fasta=False, names=False, index=False):
+    return SubsetOutput(os.path.join(output_dir, '1.fq'), os.path.join(output_dir, '2.fq'),
+                        os.path.join(output_dir, 'reads.fa') if fasta else None,
+                        os.path.join(output_dir, 'reads.txt') if names else None,
+                        index)
+
+
+class SubsetWriter(object):
+    # When appending, the offsets of the records are not known, so no
+    # index is kept
+    def __init__(self, output, append=False):
+        self.output = output
+        mode = 'ab' if append else 'wb'
+        self.f1 = fastq.open_output(output.fq1, mode)
+        self.f2 = fastq.open_output(output.fq2, mode)
+        self.fasta1 = self.fasta2 = self.names = None
+        if output.fasta is not None:
+            self.fasta1 = fastq.open_output(output.fasta, mode)
+            self.fasta2 = fastq.open_output(mate2_fasta_path(output.fasta), mode)
+        if output.names is not None:
+            self.names = fastq.open_output(output.names, mode)
+        self.index = output.index and not append
+        self.reads = 0
+        self.bases = 0
+        self.bases1 = 0
+        self.offset1 = 0
+        self.offset2 = 0
+        self.checkpoints1 = []
+        self.checkpoints2 = []
+
+    def write(self, pair):
+        name, record1, record2, bases, bases1 = pair
+        self.f1.write(record1)
+        self.f2.write(record2)
+        if self.fasta1 is not None:
+            # The header and sequence lines of the records, which are
+            # @<name>/1 (or /2) and then the sequence
+            self.fasta1.write(b'>')
+            self.fasta1.write(record1[1:len(name) + 5 + bases1])
+            self.fasta2.write(b'>')
+            self.fasta2.write(record2[1:len(name) + 5 + bases - bases1])
+        if self.names is not None:
+            self.names.write(name + b'\n')
+        if self.index:
+            if self.reads % fastq_index.FASTQ_INDEX_INTERVAL == 0:
+                self.checkpoints1.append((self.reads, self.bases1, self.offset1))
+                self.checkpoints2.append((self.reads, self.bases - self.bases1, self.offset2))
+            self.offset1 += len(record1)
+            self.offset2 += len(record2)
+        self.reads += 1
+        self.bases += bases
+        self.bases1 += bases1
+
+    # Closes the files, appending the second mates to the FASTA file unless
+    # the files are parts to be concatenated
+    def close(self, join_fasta=True):
+        self.f1.close()
+        self.f2.close()
+        if self.fasta1 is not None:
+            self.fasta2.close()
+            if join_fasta:
+                with open(mate2_fasta_path(self.output.fasta), 'rb') as fasta2_h:
+                    shutil.copyfileobj(fasta2_h, self.fasta1)
+                os.remove(mate2_fasta_path(self.output.fasta))
+            self.fasta1.close()
+        if self.names is not None:
+            self.names.close()
+        # Indexes are written after their FastQ files so they are not stale
+        if self.index:
+            fastq_index.write_fastq_index(self.output.fq1, self.reads, self.bases1, fastq_index.FASTQ_INDEX_INTERVAL, self.checkpoints1)
+            fastq_index.write_fastq_index(self.output.fq2, self.reads, self.bases - self.bases1, fastq_index.FASTQ_INDEX_INTERVAL, self.checkpoints2)
@@ -1,93 +1,455 @@
 #!/usr/bin/env python3
 
-import sys
-import os
 import argparse
 import attr
-from collections import defaultdict
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy
+import annotation
+import array_cache
+import bam
+import depth_matrix
+
+DEPTH_BLOCK_SIZE = 64 * 1024 * 1024
+DEPTH_INDEX_VERSION = 1
+TRANSCRIPT_BATCH_BASES = 1024 * 1024
+
+
+# The bases of the merged exons of the annotation are numbered consecutively,
+# so depths of exonic bases are held in one array however large the genome
+# is.  Genome positions are located with one search over the merged exon ends,
+# keyed by chromosome and position.
+def position_keys(chromosome_ids, positions):
+    return (numpy.asarray(chromosome_ids, dtype=numpy.int64) << 32) | positions
 
 
 @attr.s
-class Transcript(object):
-    name = attr.ib()
-    chromosome = attr.ib()
-    exons = attr.ib(default=attr.Factory(list))
-    direction = attr.ib(default="+")
-    depths = attr.ib(default=attr.Factory(list))
-
-    def add_exon(self, exon):
-        if self.direction == "+":
-            self.exons.append(exon)
-        else:
-            self.exons.insert(0, exon)
-
-    def set_depths(self, chromosome_depths):
-        for exon in self.exons:
-            chromosome_range = range(exon.start, exon.end + 1) if self.direction == "+" else range(exon.end, exon.start - 1, -1)
-            for chromosome_position in chromosome_range:
-                if chromosome_position in chromosome_depths:
-                    self.depths.append(chromosome_depths[chromosome_position])
-                else:
-                    self.depths.append(0)
+class ExonicBases(object):
+    chromosome_ids = attr.ib()
+    start_keys = attr.ib()
+    end_keys = attr.ib()
+    offsets = attr.ib()
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    # The exonic bases of a chromosome are numbered consecutively
+    def chromosome_range(self, chromosome_id):
+        first, last = numpy.searchsorted(self.start_keys, position_keys([chromosome_id, chromosome_id + 1], 0))
+        return int(self.offsets[first]), int(self.offsets[last])
 
-    def print_depths(self, f=sys.stdout):
-        f.write("{}\t{}\n".format(self.name, "\t".join((str(depth) for depth in self.depths))))
+    # Exonic base numbers of the positions with keys inside merged exons,
+    # and which keys those were
+    def index(self, keys):
+        merged = numpy.searchsorted(self.end_keys, keys, side='right')
+        inside = merged < len(self.end_keys)
+        inside[inside] = keys[inside] >= self.start_keys[merged[inside]]
+        merged = merged[inside]
+        return self.offsets[merged] + keys[inside] - self.start_keys[merged], inside
 
+    # The number of exonic bases before each position, so that the exonic
+    # bases of [start, end) are rank(start):rank(end)
+    def rank(self, keys):
+        merged = numpy.searchsorted(self.end_keys, keys, side='right')
+        rank = self.offsets[merged]
+        inside = merged < len(self.end_keys)
+        rank[inside] += numpy.maximum(keys[inside] - self.start_keys[merged[inside]], 0)
+        return rank
 
+    # The genome span of the merged exons of a chromosome
+    def chromosome_span(self, chromosome_id):
+        first, last = numpy.searchsorted(self.start_keys, position_keys([chromosome_id, chromosome_id + 1], 0))
+        return int(self.start_keys[first] & 0xffffffff), int(self.end_keys[last - 1] & 0xffffffff)
+
+
+def exonic_bases(gene_annotation):
+    chromosome_ids = {chromosome: i for i, chromosome in enumerate(gene_annotation.chromosomes)}
+    start_keys = []
+    end_keys = []
+    for chromosome, starts, ends in gene_annotation.merged_exons():
+        start_keys.append(position_keys(chromosome_ids[chromosome], starts))
+        end_keys.append(position_keys(chromosome_ids[chromosome], ends))
+    start_keys = numpy.concatenate(start_keys) if start_keys else numpy.zeros(0, dtype=numpy.int64)
+    end_keys = numpy.concatenate(end_keys) if end_keys else numpy.zeros(0, dtype=numpy.int64)
+    order = numpy.argsort(start_keys)
+    start_keys = start_keys[order]
+    end_keys = end_keys[order]
+    offsets = numpy.concatenate(([0], numpy.cumsum(end_keys - start_keys)))
+    return ExonicBases(chromosome_ids, start_keys, end_keys, offsets)
+
+
+# The exonic base number of the 5' base of each exon, and the step (1, or -1
+# on the minus strand) to its next base, for every exon of every transcript.
+# The depths of an exon are then one contiguous slice of the exonic depths,
+# read backwards on the minus strand, so an exon shared by several isoforms
+# costs nothing to look up again and the positions of a run of exons are one
+# cumulative sum of steps.
 @attr.s
-class Exon(object):
-    start = attr.ib()
-    end = attr.ib()
+class TranscriptIndex(object):
+    exon_offsets = attr.ib()
+    exon_firsts = attr.ib()
+    exon_steps = attr.ib()
+    exon_lengths = attr.ib()
+    transcript_lengths = attr.ib()
+
+    # All exons of the transcripts, in order
+    def exon_ids(self, transcripts):
+        exon_counts = self.exon_offsets[transcripts + 1] - self.exon_offsets[transcripts]
+        firsts = numpy.cumsum(exon_counts) - exon_counts
+        return numpy.repeat(self.exon_offsets[transcripts] - firsts, exon_counts) + numpy.arange(exon_counts.sum())
+
+    # Exonic base numbers of each position of the exons: each exon steps
+    # along from its 5' base, and jumps there from the 3' base of the exon
+    # before it
+    def positions(self, exon_ids):
+        exon_ids = exon_ids[self.exon_lengths[exon_ids] > 0]
+        exon_lengths = self.exon_lengths[exon_ids]
+        exon_firsts = self.exon_firsts[exon_ids]
+        exon_steps = self.exon_steps[exon_ids]
+        steps = numpy.repeat(exon_steps, exon_lengths)
+        exon_lasts = exon_firsts + exon_steps * (exon_lengths - 1)
+        steps[numpy.cumsum(exon_lengths) - exon_lengths] = exon_firsts - numpy.concatenate(([0], exon_lasts[:-1]))
+        return numpy.cumsum(steps)
+
+
+def transcript_index(gene_annotation, bases):
+    exon_offsets = numpy.asarray(gene_annotation.exon_offsets)
+    exon_starts = numpy.asarray(gene_annotation.exon_starts)
+    exon_lengths = numpy.maximum(numpy.asarray(gene_annotation.exon_ends) - exon_starts, 0)
+    exon_bases = numpy.zeros(len(exon_starts), dtype=numpy.int64)
+    nonempty = exon_lengths > 0
+    exon_bases[nonempty], _ = bases.index(position_keys(numpy.asarray(gene_annotation.exon_chromosome)[nonempty], exon_starts[nonempty]))
+    exon_transcript = numpy.repeat(numpy.arange(len(gene_annotation.transcripts)), numpy.diff(exon_offsets))
+    exon_minus = numpy.asarray(gene_annotation.transcript_strand)[exon_transcript] == ord('-')
+    exon_firsts = numpy.where(exon_minus, exon_bases + exon_lengths - 1, exon_bases)
+    exon_steps = numpy.where(exon_minus, -1, 1)
+    transcript_lengths = numpy.diff(numpy.concatenate(([0], numpy.cumsum(exon_lengths)))[exon_offsets])
+    return TranscriptIndex(exon_offsets, exon_firsts, exon_steps, exon_lengths, transcript_lengths)
+
+
+# Transcripts are output in groups by chromosome, in order of each
+# chromosome's first transcript, keeping annotation order within a group.
+# For an annotation sorted by chromosome this is the annotation order.
+def chromosome_groups(gene_annotation):
+    transcript_chromosome = numpy.asarray(gene_annotation.transcript_chromosome)
+    chromosome_ids, first_transcripts = numpy.unique(transcript_chromosome, return_index=True)
+    order = numpy.argsort(transcript_chromosome, kind='mergesort')
+    group_starts = numpy.searchsorted(transcript_chromosome[order], chromosome_ids, side='left')
+    group_ends = numpy.searchsorted(transcript_chromosome[order], chromosome_ids, side='right')
+    groups = []
+    for i in numpy.argsort(first_transcripts).tolist():
+        groups.append((int(chromosome_ids[i]), order[group_starts[i]:group_ends[i]]))
+    return groups
+
+
+# Blocks of whole lines from a binary file, reading at most size bytes
+def line_blocks(f, block_size=DEPTH_BLOCK_SIZE, size=None):
+    remainder = b''
+    while size is None or size > 0:
+        block = f.read(block_size if size is None else min(block_size, size))
+        if len(block) == 0:
+            break
+        if size is not None:
+            size -= len(block)
+        block = remainder + block
+        end = block.rfind(b'\n') + 1
+        remainder = block[end:]
+        if end > 0:
+            yield(block[:end])
+    if len(remainder) > 0:
+        yield(remainder + b'\n')
+
+
+# Decimal fields buf[starts[i]:ends[i]] as integers
+def parse_integers(buf, starts, ends):
+    lengths = ends - starts
+    values = numpy.zeros(len(starts), dtype=numpy.int64)
+    for digit in range(int(lengths.max()) if len(lengths) > 0 else 0):
+        has_digit = digit < lengths
+        values[has_digit] = values[has_digit] * 10 + (buf[starts[has_digit] + digit] - ord('0'))
+    return values
+
+
+# Splits a block of samtools depth lines (chromosome, 1-based position,
+# depth) into runs of consecutive lines on one chromosome.  Returns the
+# block as bytes, the offsets of the line starts, ends and tabs, and the
+# chromosome and first and last + 1 line of each run.
+def depth_lines(block):
+    buf = numpy.frombuffer(block, dtype=numpy.uint8)
+    line_ends = numpy.flatnonzero(buf == ord('\n'))
+    line_starts = numpy.concatenate(([0], line_ends[:-1] + 1))
+    tabs = numpy.flatnonzero(buf == ord('\t'))
+    if len(tabs) != 2 * len(line_ends):
+        raise ValueError('Expected three columns on every samtools depth line')
+    first_tabs = tabs[0::2]
+    second_tabs = tabs[1::2]
+
+    # A line starts a new run unless its chromosome is the same as the last
+    name_lengths = first_tabs - line_starts
+    same = name_lengths[1:] == name_lengths[:-1]
+    for offset in range(int(name_lengths.max()) if len(name_lengths) > 0 else 0):
+        same &= buf[numpy.minimum(line_starts[1:] + offset, first_tabs[1:])] == buf[numpy.minimum(line_starts[:-1] + offset, first_tabs[:-1])]
+    run_starts = numpy.flatnonzero(numpy.concatenate(([True], ~same)))
+    run_ends = numpy.concatenate((run_starts[1:], [len(line_ends)]))
+    runs = [(block[line_starts[run_start]:first_tabs[run_start]].decode(), run_start, run_end) for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist())]
+    return buf, line_starts, line_ends, first_tabs, second_tabs, runs
+
+
+# Yields the chromosome and the 0-based positions and depths of each run of
+# lines on one chromosome in a block
+def depth_runs(block):
+    buf, line_starts, line_ends, first_tabs, second_tabs, runs = depth_lines(block)
+    positions = parse_integers(buf, first_tabs + 1, second_tabs) - 1
+    depths = parse_integers(buf, second_tabs + 1, line_ends)
+    for chromosome, run_start, run_end in runs:
+        yield(chromosome, positions[run_start:run_end], depths[run_start:run_end])
+
+
+# Scatters depths into depth, which holds the exonic bases from base_offset
+def read_depths(blocks, bases, depth, base_offset=0):
+    for block in blocks:
+        for chromosome, positions, depths in depth_runs(block):
+            if chromosome not in bases.chromosome_ids:
+                continue
+            exonic, inside = bases.index(position_keys(bases.chromosome_ids[chromosome], positions))
+            exonic -= base_offset
+            wanted = (exonic >= 0) & (exonic < len(depth))
+            depth[exonic[wanted]] = depths[inside][wanted]
+
+
+# Depths straight from a coordinate-sorted BAM file, counting the reads
+# samtools depth counts by default: bases aligned by M, = and X, with
+# deletions and reference skips left out, and no cap on depth.  Each aligned
+# segment adds one over its exonic bases in a difference array, and the
+# reads of each chromosome are found through the BAI index, which is built
+# if there is none.
+def read_bam_depths(bam_fn, bases, chromosome_ids, depth, base_offset=0):
+    with open(bam_fn, 'rb') as bam_f:
+        references = bam.read_bam_header(bam_f)[1]
+    reference_ids = {name: i for i, (name, length) in enumerate(references)}
+    bai = bam.bai_for(bam_fn)
+    chromosomes = {chromosome_id: chromosome for chromosome, chromosome_id in bases.chromosome_ids.items()}
+
+    differences = numpy.zeros(len(depth) + 1, dtype=numpy.int64)
+    for chromosome_id in chromosome_ids:
+        first, last = bases.chromosome_range(chromosome_id)
+        if first == last or chromosomes[chromosome_id] not in reference_ids:
+            continue
+        span_start, span_end = bases.chromosome_span(chromosome_id)
+        for starts, ends in bam.region_aligned_segments(bam_fn, reference_ids[chromosomes[chromosome_id]], span_start, span_end, bai=bai):
+            exonic_starts = numpy.clip(bases.rank(position_keys(chromosome_id, starts)) - base_offset, 0, len(depth))
+            exonic_ends = numpy.clip(bases.rank(position_keys(chromosome_id, ends)) - base_offset, 0, len(depth))
+            covered = exonic_ends > exonic_starts
+            if not covered.any():
+                continue
+            exonic_starts = exonic_starts[covered]
+            exonic_ends = exonic_ends[covered]
+            # Coordinate-sorted reads keep each batch to a narrow window
+            window_start = exonic_starts.min()
+            window_size = exonic_ends.max() - window_start + 1
+            differences[window_start:window_start + window_size] += numpy.bincount(exonic_starts - window_start, minlength=window_size) - numpy.bincount(exonic_ends - window_start, minlength=window_size)
+    depth[:] = numpy.cumsum(differences[:-1])
+
+
+# samtools depth output holds each chromosome in one run of lines.  The byte
+# range of each run is kept in an index next to it (<depth>.index), keyed by
+# the size and mtime of the depth file and built on first use.
+def depth_index_path(fn):
+    return '{}.index'.format(fn)
+
+
+def depth_source_key(fn):
+    return array_cache.source_key(fn, DEPTH_INDEX_VERSION)
+
+
+def build_depth_index(fn):
+    source_key = depth_source_key(fn)
+    ranges = []
+    offset = 0
+    with open(fn, 'rb') as f:
+        for block in line_blocks(f):
+            _, line_starts, line_ends, _, _, runs = depth_lines(block)
+            for chromosome, run_start, run_end in runs:
+                start = offset + int(line_starts[run_start])
+                end = offset + int(line_ends[run_end - 1]) + 1
+                if len(ranges) > 0 and ranges[-1][0] == chromosome and ranges[-1][2] == start:
+                    ranges[-1][2] = end
+                else:
+                    ranges.append([chromosome, start, end])
+            offset += len(block)
+    size = os.path.getsize(fn)
+
+    # Write to a temporary file and rename it into place, so concurrent
+    # readers only ever see a complete index
+    index_path = depth_index_path(fn)
+    tmp_path = '{}.tmp{}'.format(index_path, os.getpid())
+    with open(tmp_path, 'w') as index_h:
+        index_h.write('{}\n'.format(source_key))
+        for chromosome, start, end in ranges:
+            index_h.write('{}\t{}\t{}\n'.format(chromosome, start, min(end, size)))
+    os.rename(tmp_path, index_path)
+    return load_depth_index(fn)
+
+
+def load_depth_index(fn):
+    try:
+        with open(depth_index_path(fn)) as index_h:
+            if index_h.readline().rstrip('\n') != depth_source_key(fn):
+                return None
+            depth_index = {}
+            for line in index_h:
+                chromosome, start, end = line.rstrip('\n').split('\t')
+                depth_index.setdefault(chromosome, []).append((int(start), int(end)))
+    except (OSError, ValueError):
+        return None
+    return depth_index
+
+
+def depth_index_for(fn):
+    depth_index = load_depth_index(fn)
+    if depth_index is None:
+        depth_index = build_depth_index(fn)
+    return depth_index
+
+
+# Transcripts are gathered in batches of roughly TRANSCRIPT_BATCH_BASES
+# positions with the transcript index.  Yields the transcripts, their
+# lengths and their concatenated depths.
+def transcript_depth_batches(index, transcripts, depth, base_offset=0):
+    transcript_bases = numpy.concatenate(([0], numpy.cumsum(index.transcript_lengths[transcripts])))
+    batch_start = 0
+    while batch_start < len(transcripts):
+        batch_end = int(numpy.searchsorted(transcript_bases, transcript_bases[batch_start] + TRANSCRIPT_BATCH_BASES, side='right')) - 1
+        batch_end = min(max(batch_end, batch_start + 1), len(transcripts))
+        batch = transcripts[batch_start:batch_end]
+        positions = index.positions(index.exon_ids(batch)) - base_offset
+        yield(batch, index.transcript_lengths[batch], depth[positions])
+        batch_start = batch_end
+
+
+def write_transcript_depths(gene_annotation, index, transcripts, depth, f, base_offset=0):
+    for batch, lengths, depths in transcript_depth_batches(index, transcripts, depth, base_offset):
+        depth_matrix.write_tsv_rows([gene_annotation.transcripts[transcript] for transcript in batch.tolist()], lengths, depths, f)
+
+
+# Fills the rows of the transcripts, which start at base matrix_start of the
+# depth matrix
+def fill_transcript_depths(index, transcripts, depth, matrix_depths, matrix_start, base_offset=0):
+    for batch, lengths, depths in transcript_depth_batches(index, transcripts, depth, base_offset):
+        matrix_depths[matrix_start:matrix_start + len(depths)] = depths
+        matrix_start += len(depths)
+
+
+# Worker processes load the annotation once, then each takes one chromosome
+# group at a time.  Only the exonic bases of the chromosomes holding exons of
+# the group are kept, read from their byte ranges of the depth file.
+worker_data = {}
+
+
+def init_worker(gtf):
+    gene_annotation = annotation.annotation_for(gtf)
+    bases = exonic_bases(gene_annotation)
+    worker_data['annotation'] = gene_annotation
+    worker_data['bases'] = bases
+    worker_data['index'] = transcript_index(gene_annotation, bases)
+
+
+def group_depths(depth_fn, depth_index, bam_fn, transcripts, output_dir, matrix_fn=None, matrix_start=0):
+    gene_annotation = worker_data['annotation']
+    bases = worker_data['bases']
+    index = worker_data['index']
+    exon_chromosomes = numpy.unique(numpy.asarray(gene_annotation.exon_chromosome)[index.exon_ids(transcripts)]).tolist()
+    chromosome_ranges = [bases.chromosome_range(chromosome_id) for chromosome_id in exon_chromosomes]
+    base_offset = min(first for first, last in chromosome_ranges) if chromosome_ranges else 0
+    depth = numpy.zeros(max(last for first, last in chromosome_ranges) - base_offset if chromosome_ranges else 0, dtype=numpy.uint32)
+    if bam_fn is not None:
+        read_bam_depths(bam_fn, bases, exon_chromosomes, depth, base_offset)
+    else:
+        with open(depth_fn, 'rb') as depth_f:
+            for chromosome_id in exon_chromosomes:
+                for start, end in depth_index.get(gene_annotation.chromosomes[chromosome_id], []):
+                    depth_f.seek(start)
+                    read_depths(line_blocks(depth_f, size=end - start), bases, depth, base_offset)
+    if matrix_fn is not None:
+        matrix = depth_matrix.load_depth_matrix(matrix_fn, mode='r+')
+        fill_transcript_depths(index, transcripts, depth, matrix.depths, matrix_start, base_offset)
+        matrix.flush()
+        return None
+    output_fd, output_fn = tempfile.mkstemp(dir=output_dir)
+    with os.fdopen(output_fd, 'wb') as f:
+        write_transcript_depths(gene_annotation, index, transcripts, depth, f, base_offset)
+    return output_fn
+
+
+def group_depths_task(task):
+    return group_depths(*task)
 
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument('-g', '--gtf', required=True)
-    ap.add_argument('-d', '--depth', required=True)
-    ap.add_argument('-o', '--output', required=True)
+    depth_source = ap.add_mutually_exclusive_group(required=True)
+    depth_source.add_argument('-d', '--depth')
+    depth_source.add_argument('-b', '--bam')
+    output = ap.add_mutually_exclusive_group(required=True)
+    output.add_argument('-o', '--output')
+    output.add_argument('-m', '--matrix')
+    ap.add_argument('-p', '--processes', type=int, default=1)
     args = ap.parse_args()
 
-    # Tracks wanted bases and their depths
-    wanted_bases = defaultdict(dict)
+    gene_annotation = annotation.annotation_for(args.gtf)
+    groups = chromosome_groups(gene_annotation)
 
-    # Find bases that are contained in exons.  We only need to track them.
-    transcripts = {}
-    with open(args.gtf) as gtf_f:
-        for line in gtf_f:
-            if line[0] == "#":
-                continue
-            sp_line = line.rstrip(os.linesep).split("\t")
-            feature_type = sp_line[2]
-            if feature_type != "exon":
-                continue
-            chromosome = sp_line[0]
-            # GTF uses 1-based numbering.  We switch to 0-based.
-            start = int(sp_line[3]) - 1
-            end = int(sp_line[4]) - 1
-            direction = sp_line[6]
-            info = {}
-            for info_name, value in (info_line.split(" ") for info_line in sp_line[-1].rstrip(";").split("; ")):
-                value = value[1:-1]
-                if info_name != 'tag':
-                    info[info_name] = value
-            transcript_id = info['transcript_id']
-            if transcript_id not in transcripts:
-                transcripts[transcript_id] = Transcript(transcript_id, chromosome, direction=direction)
-            transcripts[transcript_id].add_exon(Exon(start, end))
-            for idx in range(start, end + 1):
-                wanted_bases[chromosome][idx] = 0
-
-    # Read depths
-    with(open(args.depth)) as depth_f:
-        for line in depth_f:
-            sp_line = line.rstrip(os.linesep).split("\t")
-            chromosome = sp_line[0]
-            position = int(sp_line[1])
-            if position in wanted_bases[chromosome]:
-                depth = int(sp_line[2])
-                wanted_bases[chromosome][position] = depth
-
-    with open(args.output, "w") as f:
-        for transcript in transcripts.values():
-            transcript.set_depths(wanted_bases[transcript.chromosome])
-            transcript.print_depths(f)
+    if args.matrix is not None:
+        # Each group fills its own rows of the depth matrix
+        bases = exonic_bases(gene_annotation)
+        index = transcript_index(gene_annotation, bases)
+        ordered_transcripts = numpy.concatenate([transcripts for chromosome_id, transcripts in groups]) if groups else numpy.zeros(0, dtype=numpy.int64)
+        lengths = index.transcript_lengths[ordered_transcripts]
+        matrix = depth_matrix.create_depth_matrix(args.matrix, [gene_annotation.transcripts[transcript] for transcript in ordered_transcripts.tolist()], lengths)
+        group_starts = numpy.cumsum([0] + [int(index.transcript_lengths[transcripts].sum()) for chromosome_id, transcripts in groups]).tolist()
+
+    if args.processes > 1:
+        # Chromosome groups are processed in parallel, each into a temporary
+        # file copied to the output in group order, or into its rows of the
+        # matrix
+        depth_index = depth_index_for(args.depth) if args.depth is not None else None
+        # Index the BAM file once, before the workers read it
+        if args.bam is not None:
+            bam.bai_for(args.bam)
+        output_fn = args.output if args.output is not None else args.matrix
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_fn))) as output_dir, \
+                multiprocessing.Pool(args.processes, initializer=init_worker, initargs=(args.gtf,)) as pool:
+            if args.matrix is not None:
+                tasks = ((args.depth, depth_index, args.bam, transcripts, output_dir, args.matrix, group_start) for (chromosome_id, transcripts), group_start in zip(groups, group_starts))
+                for _ in pool.imap_unordered(group_depths_task, tasks):
+                    pass
+            else:
+                tasks = ((args.depth, depth_index, args.bam, transcripts, output_dir) for chromosome_id, transcripts in groups)
+                with open(args.output, "wb") as f:
+                    for group_fn in pool.imap(group_depths_task, tasks):
+                        with open(group_fn, 'rb') as group_f:
+                            shutil.copyfileobj(group_f, f)
+                        os.remove(group_fn)
+    else:
+        bases = exonic_bases(gene_annotation)
+
+        # Depths of exonic bases.  We only need to track them.
+        depth = numpy.zeros(len(bases), dtype=numpy.uint32)
+        if args.bam is not None:
+            read_bam_depths(args.bam, bases, range(len(gene_annotation.chromosomes)), depth)
+        else:
+            with open(args.depth, 'rb') as depth_f:
+                read_depths(line_blocks(depth_f), bases, depth)
+
+        index = transcript_index(gene_annotation, bases)
+        if args.matrix is not None:
+            for (chromosome_id, transcripts), group_start in zip(groups, group_starts):
+                fill_transcript_depths(index, transcripts, depth, matrix.depths, group_start)
+            matrix.flush()
+        else:
+            with open(args.output, "wb") as f:
+                for chromosome_id, transcripts in groups:
+                    write_transcript_depths(gene_annotation, index, transcripts, depth, f)
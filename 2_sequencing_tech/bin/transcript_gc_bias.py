@@ -3,30 +3,60 @@
 import sys
 import os
 import argparse
-from Bio.SeqIO.FastaIO import SimpleFastaParser
-from collections import Counter, defaultdict
-from operator import itemgetter
+import multiprocessing
+import numpy
 import matplotlib
 matplotlib.use('Agg')
 from matplotlib import pyplot
-
-
-def kmer_gc_proportions(seq, depths, avg_depth):
-    if len(seq) < 100:
-        return
-    kmer_gc_proportions.counter += 1
-    seq = seq.upper()
-    base_count = Counter(seq[:100])
-    avg_kmer_depth = sum(depths[:100]) / 100
-    yield(((base_count['G'] + base_count['C']) / 100, avg_kmer_depth / avg_depth))
-    for idx, base in enumerate(seq[100:], 100):
-        base_count[seq[idx - 100]] -= 1
-        base_count[base] += 1
-        avg_kmer_depth = sum(depths[idx - 100:idx + 1]) / 100
-        yield(((base_count['G'] + base_count['C']) / 100, avg_kmer_depth / avg_depth))
-
-
-kmer_gc_proportions.counter = 0
+import depth_matrix
+import fasta_index
+import gc_content
+
+
+GC_WINDOW = 100
+TRANSCRIPT_CHUNK_SIZE = 1000
+
+
+# Running sums of the relative depths of the windows of a transcript, binned
+# by the number of G/C bases in the window.  The GC of each 100-base window
+# and the depth of the 101 bases ending at its last base (the first window
+# takes just its own 100) come from prefix sums.
+def kmer_gc_depth_bins(seq, depths):
+    depths = numpy.asarray(depths)
+    gc_sums = gc_content.gc_sums(seq)
+    window_gc = gc_sums[GC_WINDOW:] - gc_sums[:-GC_WINDOW]
+    depth_sums = numpy.concatenate(([0], numpy.cumsum(depths, dtype=numpy.int64)))
+    window_ends = numpy.minimum(numpy.arange(GC_WINDOW, len(seq) + 1), len(depths))
+    window_starts = numpy.minimum(numpy.arange(-1, len(seq) - GC_WINDOW), len(depths))
+    window_starts[0] = 0
+    avg_depth = int(depth_sums[-1]) / len(depths)
+    depth_proportions = (depth_sums[window_ends] - depth_sums[window_starts]) / GC_WINDOW / avg_depth
+    return numpy.bincount(window_gc, weights=depth_proportions, minlength=GC_WINDOW + 1), numpy.bincount(window_gc, minlength=GC_WINDOW + 1)
+
+
+def chunk_gc_depth_bins(chunk):
+    depth_sums = numpy.zeros(GC_WINDOW + 1)
+    counts = numpy.zeros(GC_WINDOW + 1, dtype=numpy.int64)
+    transcript_count = 0
+    for seq, depths in chunk:
+        # Transcripts without reads have no relative depth
+        if len(seq) < GC_WINDOW or not numpy.any(depths):
+            continue
+        transcript_count += 1
+        transcript_depth_sums, transcript_counts = kmer_gc_depth_bins(seq, depths)
+        depth_sums += transcript_depth_sums
+        counts += transcript_counts
+    return depth_sums, counts, transcript_count
+
+
+# Yields the bins of each chunk of transcripts, spreading the chunks over
+# processes
+def gc_depth_bins(chunks, processes=1):
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            yield from pool.imap_unordered(chunk_gc_depth_bins, chunks)
+    else:
+        yield from map(chunk_gc_depth_bins, chunks)
 
 
 if __name__ == '__main__':
@@ -38,6 +68,7 @@ if __name__ == '__main__':
     ap.add_argument('-l', '--library', required=True)
     ap.add_argument('-m', '--metadata', required=True)
     ap.add_argument('-o', '--output-file', required=True)
+    ap.add_argument('-p', '--processes', type=int, default=1)
     args = ap.parse_args()
 
     metadata = {}
@@ -54,41 +85,28 @@ if __name__ == '__main__':
     with open(args.transcript_names_file) as transcript_names_h:
         wanted_transcripts.update((line.strip() for line in transcript_names_h))
 
-    transcript_seqs = {}
-    with open(args.transcript_fasta_file) as transcript_fasta_h:
-        for title, seq in SimpleFastaParser(transcript_fasta_h):
-            transcript_name = title.split(' ')[0]
-            if transcript_name in wanted_transcripts:
-                transcript_seqs[transcript_name] = seq
-
-    transcript_depths = {}
-    with open(args.depths_file) as depths_h:
-        for line in depths_h:
-            sp_line = line.rstrip(os.linesep).split('\t')
-            transcript = sp_line[0]
-            if transcript in wanted_transcripts:
-                transcript_depths[transcript] = [int(entry) for entry in sp_line[1:]]
-
-    all_kmer_gc_proportions = []
-    for transcript in wanted_transcripts:
-        depths = transcript_depths[transcript]
-        seq = transcript_seqs[transcript]
-        avg_depth = sum(depths) / len(depths)
-        all_kmer_gc_proportions.extend(kmer_gc_proportions(seq, depths, avg_depth))
-
-    all_kmer_gc_proportions.sort(key=itemgetter(0))
-
-    kmer_gc_proportions_hsh = defaultdict(list)
-    for gc_prop, depth_prop in all_kmer_gc_proportions:
-        kmer_gc_proportions_hsh[gc_prop].append(depth_prop)
-    for gc_prop, depth_prop_list in kmer_gc_proportions_hsh.items():
-        kmer_gc_proportions_hsh[gc_prop] = sum(depth_prop_list) / len(depth_prop_list)
+    transcript_seqs = fasta_index.fetch_sequences(args.transcript_fasta_file, wanted_transcripts)
+
+    transcript_depths = depth_matrix.depth_matrix_for(args.depths_file, wanted_transcripts).select(wanted_transcripts)
+
+    # Transcripts are binned in chunks, in parallel with -p
+    transcripts = list(wanted_transcripts)
+    chunks = ([(transcript_seqs[transcript], transcript_depths[transcript]) for transcript in transcripts[start:start + TRANSCRIPT_CHUNK_SIZE]] for start in range(0, len(transcripts), TRANSCRIPT_CHUNK_SIZE))
+    depth_sums = numpy.zeros(GC_WINDOW + 1)
+    counts = numpy.zeros(GC_WINDOW + 1, dtype=numpy.int64)
+    transcript_count = 0
+    for chunk_depth_sums, chunk_counts, chunk_transcript_count in gc_depth_bins(chunks, args.processes):
+        depth_sums += chunk_depth_sums
+        counts += chunk_counts
+        transcript_count += chunk_transcript_count
+
+    bins = numpy.flatnonzero(counts)
 
     fig, ax1 = pyplot.subplots()
     ax1.set_ylim((0, 1.5))
 
-    x_vals = [x for x, y in kmer_gc_proportions_hsh.items()]
-    y_vals = [y for x, y in kmer_gc_proportions_hsh.items()]
+    x_vals = bins / GC_WINDOW
+    y_vals = depth_sums[bins] / counts[bins]
 
     ax1.scatter(x_vals, y_vals, color='#{}'.format(color))
     ax1.set_xlabel('GC Proportion (100-base windows)')
@@ -96,4 +114,4 @@ if __name__ == '__main__':
     ax1.set_title(args.title)
 
     pyplot.savefig(args.output_file, dpi=600)
-    sys.stderr.write(f'transcripts: {kmer_gc_proportions.counter}\n')
+    sys.stderr.write(f'transcripts: {transcript_count}\n')